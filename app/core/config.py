@@ -8,6 +8,37 @@ class Settings(BaseSettings):
     jwt_algorithm: str = "HS256"
     jwt_expiration_minutes: int | None = None  # None means no expiration (infinite)
 
+    # background solve jobs
+    solver_pool_size: int = 2  # number of processes that run ModelSolver
+    solver_queue_size: int = 20  # jobs waiting for a process, more are rejected
+    # cp-sat workers shared by the running solves, None means the cgroup cpu quota
+    solver_worker_budget: int | None = None
+    solver_job_history: int = 100  # finished jobs kept in memory for status lookups
+    # seconds /solve waits for its job, after that the job is left running in the background
+    solver_request_timeout: float = 600
+
+    # caps on the cp-sat search parameters a request may ask for
+    solver_max_workers: int | None = None  # None means the cgroup cpu quota
+    solver_max_time_in_seconds: float = 300
+    solver_max_relative_gap_limit: float = 0.5
+    solver_allowed_search_strategies: list[str] = [
+        "automatic",
+        "fixed",
+        "portfolio",
+        "preferred_first",
+    ]
+    # catalogs with less time slots than this are solved as a single model
+    solver_decompose_min_variables: int = 2000
+    # built cp models are reused when the solver input did not change, 0 disables the cache
+    solver_model_cache_dir: str = "./.solver_cache/models"
+    solver_model_cache_max_bytes: int = 512 * 1024 * 1024
+    # generated professor slots reused across solves, 0 disables the catalog
+    solver_slot_catalog_size: int = 4096  # (professor, duration) entries kept in memory
+    solver_slot_catalog_persist: bool = False  # also keep them in the slotcatalogentry table
+    # zlib level of the stored solver results, 0 stores them uncompressed
+    solver_history_compression_level: int = 6
+    # jobs kept for identical solve requests (same input and settings), 0 disables it
+    solver_result_cache_size: int = 32
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
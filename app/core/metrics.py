@@ -0,0 +1,224 @@
+import math
+import threading
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from time import perf_counter
+
+# Metrics of this process in the prometheus text format, kept free of imports besides
+# the standard library since the solver processes import it too. The pool processes
+# don't report to the registry, their spans and stats are sent back with the result
+# and recorded by the server process.
+
+# (phase, seconds) in the order the phases ran, a phase can repeat
+Spans = list[tuple[str, float]]
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+
+@contextmanager
+def span(spans: Spans, phase: str) -> Iterator[None]:
+    """Appends the duration of the block to spans, also when it raises"""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((phase, perf_counter() - start))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        function: Callable[[], float] | None = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        # read on every scrape, for values another object already counts
+        self.function = function
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, object]) -> tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {self.labels}")
+        return tuple(str(labels[x]) for x in self.labels)
+
+    def _samples(self) -> Iterator[tuple[str, str, float]]:
+        if self.function is not None:
+            yield self.name, "", self.function()
+            return
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labels, key), value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{labels} {_format_value(value)}"
+            for name, labels, value in self._samples()
+        )
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = (*sorted(buckets), math.inf)
+        # bucket counts (not cumulative), sum and count of every label set
+        self._observations: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = self._key(labels)
+        with self._lock:
+            observation = self._observations.setdefault(
+                key, [0.0] * (len(self.buckets) + 2)
+            )
+            observation[next(i for i, x in enumerate(self.buckets) if value <= x)] += 1
+            observation[-2] += value
+            observation[-1] += 1
+
+    def _samples(self) -> Iterator[tuple[str, str, float]]:
+        with self._lock:
+            observations = [(k, list(v)) for k, v in self._observations.items()]
+        for key, observation in observations:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, observation):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels((*self.labels, "le"), (*key, _format_value(bound))),
+                    cumulative,
+                )
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum", labels, observation[-2]
+            yield f"{self.name}_count", labels, observation[-1]
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, **kwargs) -> Counter:
+        return self.register(Counter(name, documentation, **kwargs))  # type: ignore
+
+    def gauge(self, name: str, documentation: str, **kwargs) -> Gauge:
+        return self.register(Gauge(name, documentation, **kwargs))  # type: ignore
+
+    def histogram(self, name: str, documentation: str, **kwargs) -> Histogram:
+        return self.register(Histogram(name, documentation, **kwargs))  # type: ignore
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+SOLVER_PHASE_SECONDS = registry.histogram(
+    "solver_phase_seconds",
+    "Duration of the phases of the solve requests",
+    labels=("phase",),
+)
+SOLVER_JOBS = registry.counter(
+    "solver_jobs_total", "Finished solver jobs by status", labels=("status",)
+)
+SOLVER_SEARCH_SECONDS = registry.histogram(
+    "solver_search_wall_seconds", "Wall time cp-sat spent on the searches of a job"
+)
+SOLVER_BRANCHES = registry.counter(
+    "solver_search_branches_total", "Branches explored by cp-sat"
+)
+SOLVER_CONFLICTS = registry.counter(
+    "solver_search_conflicts_total", "Conflicts found by cp-sat"
+)
+SOLVER_OBJECTIVE = registry.gauge(
+    "solver_search_objective", "Objective of the last finished job"
+)
+SOLVER_BOUND = registry.gauge(
+    "solver_search_bound", "Objective bound of the last finished job"
+)
+SOLVER_GAP = registry.gauge(
+    "solver_search_gap", "Relative gap between objective and bound of the last job"
+)
+SOLVER_MODEL_SIZE = registry.gauge(
+    "solver_model_size",
+    "Courses, variables and constraints of the model of the last job",
+    labels=("kind",),
+)
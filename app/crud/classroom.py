@@ -5,6 +5,7 @@ from sqlmodel import select
 
 from app.models.classroom import Classroom
 from app.schemas.classroom import ClassroomCreate, ClassroomUpdate
+from app.tasks.results import result_cache
 
 
 def create_classroom(session: Session, classroom_data: ClassroomCreate) -> Classroom:
@@ -12,6 +13,7 @@ def create_classroom(session: Session, classroom_data: ClassroomCreate) -> Class
     session.add(classroom)
     session.commit()
     session.refresh(classroom)
+    result_cache.invalidate()
     return classroom
 
 
@@ -36,6 +38,7 @@ def update_classroom(
 
     session.commit()
     session.refresh(classroom)
+    result_cache.invalidate()
     return classroom
 
 
@@ -46,4 +49,5 @@ def delete_classroom(session: Session, classroom_id: int) -> bool:
 
     session.delete(classroom)
     session.commit()
+    result_cache.invalidate()
     return True
@@ -8,6 +8,7 @@ from app.crud.classroom import get_classroom
 from app.crud.major import get_major
 from app.models.course import Course, CourseProfessorLink
 from app.schemas.course import CourseCreate, CourseUpdate
+from app.tasks.results import result_cache
 
 
 def create_course(db: Session, course_data: CourseCreate) -> Course:
@@ -36,6 +37,7 @@ def create_course(db: Session, course_data: CourseCreate) -> Course:
         link = CourseProfessorLink(course_id=course.id, professor_id=professor_id)
         db.add(link)
     db.commit()
+    result_cache.invalidate()
 
     return course
 
@@ -94,6 +96,7 @@ def update_course(
 
     db.commit()
     db.refresh(course)
+    result_cache.invalidate()
     return course
 
 
@@ -111,4 +114,5 @@ def delete_course(db: Session, course_id: int) -> bool:
     # Delete the course
     db.delete(course)
     db.commit()
+    result_cache.invalidate()
     return True
@@ -3,12 +3,14 @@ from typing import List, Optional
 from sqlmodel import Session, select
 
 from app.models import Major
+from app.tasks.results import result_cache
 
 
 def create_major(session: Session, major_data: Major) -> Major:
     session.add(major_data)
     session.commit()
     session.refresh(major_data)
+    result_cache.invalidate()
     return major_data
 
 
@@ -26,6 +28,7 @@ def delete_major(session: Session, major_id: int) -> bool:
     if major:
         session.delete(major)
         session.commit()
+        result_cache.invalidate()
         return True
     return False
 
@@ -46,4 +49,5 @@ def update_major(
     session.add(major)
     session.commit()
     session.refresh(major)
+    result_cache.invalidate()
     return major
@@ -7,6 +7,8 @@ from sqlmodel import Session, select
 from app.crud.major import get_major
 from app.models.professor import Professor
 from app.schemas.professors import ProfessorCreate, ProfessorUpdate
+from app.solver.catalog import slot_catalog
+from app.tasks.results import result_cache
 
 
 def create_professor(session: Session, professor_data: ProfessorCreate) -> Professor:
@@ -17,6 +19,7 @@ def create_professor(session: Session, professor_data: ProfessorCreate) -> Profe
     session.add(professor)
     session.commit()
     session.refresh(professor)
+    result_cache.invalidate()
     return professor
 
 
@@ -39,11 +42,15 @@ def update_professor(
         major = get_major(session, update_data.major_id)
         if not major:
             raise HTTPException(status_code=404, detail="major not found")
-    for key, value in update_data.model_dump(exclude_unset=True).items():
+    changes = update_data.model_dump(exclude_unset=True)
+    for key, value in changes.items():
         setattr(professor, key, value)
 
     session.commit()
     session.refresh(professor)
+    if "time_slots" in changes or "preferred_days" in changes:
+        slot_catalog.invalidate(professor_id, session)
+    result_cache.invalidate()
     return professor
 
 
@@ -54,4 +61,6 @@ def delete_professor(session: Session, professor_id: int) -> bool:
 
     session.delete(professor)
     session.commit()
+    slot_catalog.invalidate(professor_id, session)
+    result_cache.invalidate()
     return True
@@ -0,0 +1,35 @@
+from typing import List
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, delete, select
+
+from app.models.slot_catalog import SlotCatalogEntry
+
+
+def list_slot_catalog_entries(
+    session: Session, professor_ids: List[int]
+) -> List[SlotCatalogEntry]:
+    query = select(SlotCatalogEntry).where(
+        col(SlotCatalogEntry.professor_id).in_(professor_ids)
+    )
+    return session.exec(query).all()  # type: ignore
+
+
+def create_slot_catalog_entries(
+    session: Session, entries: List[SlotCatalogEntry]
+) -> None:
+    session.add_all(entries)
+    try:
+        session.commit()
+    except IntegrityError:
+        # another request stored some of the same slots first, they are generated again next time
+        session.rollback()
+
+
+def delete_slot_catalog_entries(session: Session, professor_id: int) -> None:
+    session.exec(  # type: ignore
+        delete(SlotCatalogEntry).where(
+            col(SlotCatalogEntry.professor_id) == professor_id
+        )
+    )
+    session.commit()
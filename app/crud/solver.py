@@ -1,16 +1,38 @@
+from datetime import datetime, timezone
 from typing import List, Optional
 
+from sqlalchemy import Row, tuple_
 from sqlalchemy.orm import Session
-from sqlmodel import select
+from sqlmodel import col, select
 
 from app.models.solver import SolverResualt
 from app.schemas.solver import SolverHistoryResualtCreate
+from app.tasks.results import result_cache
+from app.utils.history import pack_solutions, solution_scores
 
 
 def create_solver_resualt(
-    session: Session, solver_resualt_data: SolverHistoryResualtCreate
+    session: Session,
+    solver_resualt_data: SolverHistoryResualtCreate,
+    input_fingerprints: dict | None = None,
 ) -> SolverResualt:
-    solver_resualt = SolverResualt(**solver_resualt_data.model_dump())
+    """input_fingerprints is only set by the solver jobs, the next incremental solve
+    trusts it, so it is not part of the api schema"""
+    solver_resualt = SolverResualt(
+        **solver_resualt_data.model_dump(exclude={"resualt"}),
+        solution_count=len(solver_resualt_data.resualt),
+        input_fingerprints=input_fingerprints,
+    )
+    packed = pack_solutions(solver_resualt_data.resualt)
+    if packed is None:
+        solver_resualt.resualt = solver_resualt_data.model_dump(mode="json")["resualt"]
+    else:
+        (
+            solver_resualt.snapshot,
+            solver_resualt.assignments,
+            solver_resualt.course_index,
+        ) = packed
+        solver_resualt.scores = solution_scores(solver_resualt_data.resualt)
     session.add(solver_resualt)
     session.commit()
     session.refresh(solver_resualt)
@@ -23,8 +45,55 @@ def get_solver_resualt(
     return session.get(SolverResualt, solver_resualt_id)
 
 
-def list_solver_resualts(session: Session) -> List[SolverResualt]:
-    query = select(SolverResualt).order_by(SolverResualt.created_at.desc())  # type: ignore
+def get_latest_solver_resualt(session: Session) -> Optional[SolverResualt]:
+    """Most recent result produced by the solver (results saved by hand have no fingerprints)"""
+    query = (
+        select(SolverResualt)
+        .where(SolverResualt.input_fingerprints.is_not(None))  # type: ignore
+        .order_by(SolverResualt.created_at.desc())  # type: ignore
+        .limit(1)
+    )
+    return session.exec(query).first()  # type: ignore
+
+
+def _utc(value: datetime) -> datetime:
+    """created_at is stored as naive utc"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def list_solver_resualts(
+    session: Session,
+    limit: int = 50,
+    before_id: Optional[int] = None,
+    name: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+) -> List[Row]:
+    """id, name and created_at of the results, newest first. Only those columns are read,
+    the next page starts after the result before_id (keyset, no offset scan)"""
+    query = select(SolverResualt.id, SolverResualt.name, SolverResualt.created_at)
+    if before_id is not None:
+        cursor = session.exec(
+            select(SolverResualt.created_at).where(SolverResualt.id == before_id)  # type: ignore
+        ).first()
+        if cursor is None:  # the result was deleted, ids still grow with created_at
+            query = query.where(SolverResualt.id < before_id)
+        else:
+            query = query.where(
+                tuple_(col(SolverResualt.created_at), col(SolverResualt.id))
+                < tuple_(cursor, before_id)
+            )
+    if name:
+        query = query.where(col(SolverResualt.name).contains(name))
+    if created_from is not None:
+        query = query.where(SolverResualt.created_at >= _utc(created_from))
+    if created_to is not None:
+        query = query.where(SolverResualt.created_at < _utc(created_to))
+    query = query.order_by(
+        col(SolverResualt.created_at).desc(), col(SolverResualt.id).desc()
+    ).limit(limit)
     return session.exec(query).all()  # type: ignore
 
 
@@ -35,4 +104,5 @@ def delete_solver_resualt(session: Session, solver_resualt_id: int) -> bool:
 
     session.delete(solver_resualt)
     session.commit()
+    result_cache.discard_resualt(solver_resualt_id)
     return True
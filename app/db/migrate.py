@@ -0,0 +1,46 @@
+import logging
+
+from sqlalchemy import Column, Engine, inspect, literal, text
+from sqlmodel import SQLModel
+
+logger = logging.getLogger()
+
+
+def _column_definition(column: Column, engine: Engine) -> str:
+    """Type and constraints of a column added to an existing table, the rows it already
+    has get the default of a not nullable column"""
+    definition = column.type.compile(dialect=engine.dialect)
+    default = column.default
+    if column.nullable or default is None or not default.is_scalar:  # type: ignore
+        return definition
+    value = literal(default.arg, column.type).compile(  # type: ignore
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    return f"{definition} NOT NULL DEFAULT {value}"
+
+
+def migrate(engine: Engine) -> None:
+    """Adds the columns and indexes that were added to the models after their table was
+    created, create_all only creates the missing tables"""
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                logger.info("adding the column %s.%s", table.name, column.name)
+                connection.execute(
+                    text(
+                        f"ALTER TABLE {quote(table.name)} ADD COLUMN "
+                        f"{quote(column.name)} {_column_definition(column, engine)}"
+                    )
+                )
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    logger.info("adding the index %s", index.name)
+                    index.create(connection)
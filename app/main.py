@@ -1,6 +1,7 @@
 from fastapi import FastAPI  # noqa: I001
 from app.core.config import settings
 from app.db.session import engine
+from app.db.migrate import migrate
 from sqlmodel import SQLModel
 from app.routes.major import router as major_router
 from app.routes.professors import router as professor_router
@@ -8,7 +9,10 @@ from app.routes.auth import router as auth_router
 from app.routes.classroom import router as classroom_router
 from app.routes.course import router as course_router
 from app.routes.solver import router as solver_router
+from app.tasks.jobs import shutdown_jobs
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import registry
 
 
 def create_app() -> FastAPI:
@@ -34,7 +38,9 @@ def create_app() -> FastAPI:
 
 async def lifespan_context(app: FastAPI):
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
     yield
+    shutdown_jobs()
 
 
 app = create_app()
@@ -43,3 +49,11 @@ app = create_app()
 @app.get("/")
 async def home():
     return {"message": "Hello World"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """Solver metrics in the prometheus text format"""
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
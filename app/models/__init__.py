@@ -2,5 +2,6 @@ from .classroom import Classroom
 from .course import Course
 from .major import Major
 from .professor import Professor
+from .slot_catalog import SlotCatalogEntry
 from .solver import SolverResualt
 from .user import User
@@ -0,0 +1,12 @@
+from sqlmodel import Column, Field, LargeBinary, SQLModel
+
+
+class SlotCatalogEntry(SQLModel, table=True):
+    """Generated time slots of a professor for one course duration"""
+
+    professor_id: int = Field(primary_key=True)
+    # digest of the professor time_slots and preferred_days the slots were generated from
+    availability_hash: str = Field(primary_key=True)
+    duration: str = Field(primary_key=True)  # hh:mm
+    # int32 rows of day, start, end (minutes), professor id, prefered
+    slots: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
@@ -1,13 +1,31 @@
 from datetime import datetime, timezone
 from typing import TYPE_CHECKING, Optional
 
-from sqlmodel import JSON, Column, Field, SQLModel
+from sqlmodel import JSON, Column, Field, LargeBinary, SQLModel
 
 
 class SolverResualt(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
-    resualt: list = Field(sa_column=Column(JSON))
+    # results that are not in the solver output shape, the rest use snapshot and assignments
+    resualt: Optional[list] = Field(
+        default=None, sa_column=Column(JSON(none_as_null=True))
+    )
+    # zlib json lines, the distinct selected slots of the run and then one course per line
+    snapshot: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    # zlib int32 matrix, the index of the selected slot of every course in every solution
+    assignments: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    # zlib json, positions of the courses of every group, major and classroom
+    course_index: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
+    solution_count: int = 0
+    # SolverSolutionScore of every solution
+    scores: Optional[list] = Field(
+        default=None, sa_column=Column(JSON(none_as_null=True))
+    )
+    # digests of the solver input, used to find what changed for incremental solves
+    input_fingerprints: Optional[dict] = Field(
+        default=None, sa_column=Column(JSON(none_as_null=True))
+    )
     created_at: datetime = Field(
-        default_factory=lambda: datetime.now(timezone.utc)
+        default_factory=lambda: datetime.now(timezone.utc), index=True
     )  # Auto set to current time
@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends, status
-from fastapi.responses import JSONResponse
+import asyncio
+from datetime import datetime
+from time import monotonic
+
+from fastapi import APIRouter, Depends, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session
 from typing_extensions import Annotated
 
+from app.core.config import settings as app_settings
 from app.core.dependencies import get_current_user
+from app.core.metrics import Spans, span
 from app.crud.course import list_courses
 from app.crud.professors import list_professors
 from app.crud.solver import (
     create_solver_resualt,
     delete_solver_resualt,
+    get_latest_solver_resualt,
     get_solver_resualt,
     list_solver_resualts,
 )
@@ -16,82 +24,368 @@ from app.db.session import get_session
 from app.schemas.course import CourseRead
 from app.schemas.errors import Error404Response
 from app.schemas.professors import ProfessorRead
+from app.schemas.solver import Courses as SolverCourse
 from app.schemas.solver import (
-    CourceTimeSlots,
     SolverHistoryResualtCreate,
     SolverHistoryResualtRead,
     SolverHistoryResualtReadLight,
+    SolverJobRead,
+    SolverJobStatus,
+    SolverQueueRead,
     SolverResualt,
     SolverSettings,
     SolverSolution,
+    SolverSolutionDiff,
 )
-from app.schemas.solver import Courses as SolverCourse
-from app.solver.solver import ModelSolver
-from app.utils.parser import (
-    convert_course_read_list_to_solver_course_list,
-    parse_solver_output,
+from app.solver.incremental import input_fingerprints, plan_incremental
+from app.tasks.jobs import (
+    SolverJob,
+    SolverQueueFullError,
+    cancel_job,
+    get_job,
+    hold_job,
+    list_jobs,
+    queue_stats,
+    release_job,
+    stored_solution_events,
+    submit_solve_job,
 )
+from app.tasks.results import result_cache, result_key
+from app.utils.history import diff_solutions, read_solution, read_solutions
+from app.utils.parser import convert_course_read_list_to_solver_course_list
 
 SessionDep = Annotated[Session, Depends(dependency=get_session)]
 
+# seconds between two checks of a /solve client that waits for its job
+DISCONNECT_POLL_SECONDS = 0.5
+
 router = APIRouter(dependencies=[Depends(get_current_user)])
 
 
+def _submit_solve(
+    session: Session, settings: SolverSettings, interactive: bool = False
+) -> SolverJob:
+    """Queues the solve of the current data, an identical request (same input and
+    settings) gets the job of the earlier one. Interactive solves (a client waits
+    for them) start before the background jobs"""
+    # read before the input, a write after this point keeps the job out of the cache
+    generation = result_cache.generation
+    spans: Spans = []
+    with span(spans, "db_fetch"):
+        db_courses = list_courses(session)
+        db_professors = list_professors(session=session)
+    with span(spans, "validation"):
+        courses: list[CourseRead] = [
+            CourseRead.model_validate(course, from_attributes=True)
+            for course in db_courses
+        ]
+        professors: list[ProfessorRead] = [
+            ProfessorRead.model_validate(professor, from_attributes=True)
+            for professor in db_professors
+        ]
+    model_data: list[SolverCourse]
+    with span(spans, "slot_conversion"):
+        model_data, slots = convert_course_read_list_to_solver_course_list(
+            courses, session
+        )
+    dict_professors = {p.id: p for p in professors}
+    settings.debug=True
+    fingerprints = input_fingerprints(slots, dict_professors)
+    warm_start = None
+    if settings.incremental:
+        previous = get_latest_solver_resualt(session)
+        previous_solutions = read_solutions(previous, 0, 1) if previous else []
+        if previous_solutions:
+            warm_start = plan_incremental(
+                slots,
+                settings,
+                fingerprints,
+                previous.input_fingerprints,  # type: ignore
+                previous_solutions[0],
+            )
+    return result_cache.get_or_submit(
+        result_key(fingerprints, settings),
+        generation,
+        lambda: submit_solve_job(
+            model_data,
+            slots,
+            settings,
+            dict_professors,
+            input_fingerprints=fingerprints,
+            warm_start=warm_start,
+            spans=spans,
+            interactive=interactive,
+        ),
+    )
+
+
+def _queue_full_response(ex: SolverQueueFullError) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"message": str(ex), "retry_after": ex.retry_after},
+        headers={"Retry-After": str(ex.retry_after)},
+    )
+
+
+def _job_resualt_response(job: SolverJob, session: Session):
+    if job.status == SolverJobStatus.FAILED:
+        if job.input_error:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"message": job.error},
+            )
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content=job.error
+        )
+    if job.solver_resualt_id is None:
+        # queued, running or cancelled without keeping its solutions
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": f"Solver job is {job.status.value}"},
+        )
+    solver_history_resualt = get_solver_resualt(session, job.solver_resualt_id)  # type: ignore
+    if not solver_history_resualt:
+        return JSONResponse(
+            status_code=404, content={"message": "Solver result not found"}
+        )
+    return SolverResualt(
+        Solutions=read_solutions(solver_history_resualt),  # type: ignore
+        settings=job.settings,
+        solver_resualt_history=SolverHistoryResualtReadLight(
+            **solver_history_resualt.model_dump()
+        ),
+        objective=job.objective,
+        bound=job.bound,
+        gap=job.gap,
+        optimal=job.optimal,
+    )
+
+
 @router.post(
     "/solve",
     responses={
         400: {
             "description": "Something is wrong with the input data",
         },
+        503: {"description": "Too many solves are waiting, retry after Retry-After"},
+        504: {"description": "The solve takes too long, poll the returned job_id"},
     },
     response_model=SolverResualt,
 )
-def solve(settings: SolverSettings, session: SessionDep):
-    courses: list[CourseRead] = [
-        CourseRead.model_validate(course, from_attributes=True)
-        for course in list_courses(session)
-    ]
-    professors: list[ProfessorRead] = [
-        ProfessorRead.model_validate(professor, from_attributes=True)
-        for professor in list_professors(session=session)
-    ]
-    model_data: list[SolverCourse] = convert_course_read_list_to_solver_course_list(
-        courses
-    )
-    dict_professors = {p.id: p for p in professors}
-    settings.debug=True
-    model = ModelSolver(data=model_data, settings=settings, professors=dict_professors)
+async def solve(settings: SolverSettings, session: SessionDep, request: Request):
+    # the search itself runs in the solver process pool, the request awaits it without
+    # holding a thread and cancels it when the client goes away
     try:
-        data: list[list[tuple[int, CourceTimeSlots, int]]] = model.solve()
-        if len(data) == 0 or len(data[0]) == 0:
-            raise ValueError("جوابی پیدا نشد")
-        output_sols: list[SolverSolution] = parse_solver_output(
-            sols=data, input_courses=model_data, professors=dict_professors
-        )
-        solver_history_resualt = create_solver_resualt(
-            session=session,
-            solver_resualt_data=SolverHistoryResualtCreate(
-                name=settings.solver_resualt_name, resualt=output_sols
-            ),
+        job = await run_in_threadpool(_submit_solve, session, settings, True)
+    except ValueError as ex:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": str(ex)},
         )
+    except SolverQueueFullError as ex:
+        return _queue_full_response(ex)
+    # gives the db connection back to the pool while waiting, the session reconnects
+    # for reading the result
+    session.close()
+    hold_job(job)
+    deadline = monotonic() + app_settings.solver_request_timeout
+    try:
+        while not await job.wait(DISCONNECT_POLL_SECONDS):
+            if await request.is_disconnected():
+                # nobody reads the response
+                return JSONResponse(
+                    status_code=499, content={"message": "Client closed request"}
+                )
+            if monotonic() > deadline:
+                # kept running, the result can be fetched through /jobs/{job_id}
+                job.detached = True
+                return JSONResponse(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    content={
+                        "message": "Solver job is still running",
+                        "job_id": job.id,
+                    },
+                )
+    finally:
+        release_job(job)
+    return await run_in_threadpool(_job_resualt_response, job, session)
+
+
+async def _stream_job_events(job: SolverJob, hold: bool = False):
+    """Server sent events of the job: queued, started, presolve, progress, incumbent,
+    solution and finally finished, failed or cancelled. With hold the client counts as
+    waiting for the job, which is cancelled if it disconnects"""
+    if hold:
+        hold_job(job)
+    queue: asyncio.Queue = asyncio.Queue()
+    history, closed = job.subscribe(asyncio.get_running_loop(), queue)
+    try:
+        if closed:
+            # only the last event is kept, the solutions are in the history row
+            for message in await run_in_threadpool(stored_solution_events, job):
+                yield message
+        for message in history:
+            yield message
+        if closed:
+            return
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=15)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if message is None:
+                return
+            yield message
+    finally:
+        job.unsubscribe(queue)
+        if hold:
+            release_job(job)
+
+
+def _event_stream_response(job: SolverJob, hold: bool = False) -> StreamingResponse:
+    return StreamingResponse(
+        _stream_job_events(job, hold),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
-        solver_resualt = SolverResualt(
-            Solutions=output_sols,
-            settings=settings,
-            solver_resualt_history=SolverHistoryResualtReadLight(
-                **solver_history_resualt.model_dump()
-            ),
+@router.post(
+    "/solve/stream",
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        400: {
+            "description": "Something is wrong with the input data",
+        },
+        503: {"description": "Too many solves are waiting, retry after Retry-After"},
+    },
+    response_class=StreamingResponse,
+)
+def solve_stream(settings: SolverSettings, session: SessionDep):
+    """Like /solve, but every solution is sent as a server sent event as soon as it is found"""
+    try:
+        job = _submit_solve(session, settings, interactive=True)
+    except ValueError as ex:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={"message": str(ex)},
         )
-        return solver_resualt
+    except SolverQueueFullError as ex:
+        return _queue_full_response(ex)
+    # the session is only closed after the stream ends
+    session.close()
+    return _event_stream_response(job, hold=True)
+
+
+@router.post(
+    "/jobs/",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=SolverJobRead,
+    responses={
+        400: {
+            "description": "Something is wrong with the input data",
+        },
+        503: {"description": "Too many solves are waiting, retry after Retry-After"},
+    },
+)
+def create_solver_job_endpoint(settings: SolverSettings, session: SessionDep):
+    try:
+        job = _submit_solve(session, settings)
     except ValueError as ex:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={"message": str(ex)},
         )
-    except Exception as ex:
+    except SolverQueueFullError as ex:
+        return _queue_full_response(ex)
+    # kept running without a client, until it is cancelled through the api
+    job.detached = True
+    return job.to_read()
+
+
+@router.get("/queue", response_model=SolverQueueRead)
+def get_solver_queue_endpoint():
+    """Running and waiting solves and the capacity of the solver pool"""
+    return SolverQueueRead(**queue_stats())
+
+
+@router.get("/jobs/", response_model=list[SolverJobRead])
+def list_solver_jobs_endpoint():
+    return [job.to_read() for job in list_jobs()]
+
+
+@router.get(
+    "/jobs/{job_id}",
+    response_model=SolverJobRead,
+    responses={
+        404: {"description": "Solver job not found", "model": Error404Response},
+    },
+)
+def get_solver_job_endpoint(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"message": "Solver job not found"})
+    return job.to_read()
+
+
+@router.post(
+    "/jobs/{job_id}/cancel",
+    response_model=SolverJobRead,
+    responses={
+        404: {"description": "Solver job not found", "model": Error404Response},
+        409: {"description": "The job already ended"},
+    },
+)
+def cancel_solver_job_endpoint(
+    job_id: str,
+    persist: Annotated[
+        bool, Query(description="save the solutions found so far as a result")
+    ] = False,
+):
+    """Stops a queued or running solve, the cp-sat search stops within a second"""
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"message": "Solver job not found"})
+    if not cancel_job(job, persist):
         return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content=str(ex)
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": f"Solver job is {job.status.value}"},
         )
+    return job.to_read()
+
+
+@router.get(
+    "/jobs/{job_id}/events",
+    responses={
+        200: {"content": {"text/event-stream": {}}},
+        404: {"description": "Solver job not found", "model": Error404Response},
+    },
+    response_class=StreamingResponse,
+)
+def get_solver_job_events_endpoint(job_id: str):
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"message": "Solver job not found"})
+    return _event_stream_response(job)
+
+
+@router.get(
+    "/jobs/{job_id}/resualt",
+    response_model=SolverResualt,
+    responses={
+        400: {
+            "description": "Something is wrong with the input data",
+        },
+        404: {"description": "Solver job not found", "model": Error404Response},
+        409: {"description": "Solver job is not finished yet"},
+    },
+)
+def get_solver_job_resualt_endpoint(job_id: str, session: SessionDep):
+    job = get_job(job_id)
+    if not job:
+        return JSONResponse(status_code=404, content={"message": "Solver job not found"})
+    return _job_resualt_response(job, session)
 
 
 @router.post("/resualt/", response_model=SolverHistoryResualtReadLight)
@@ -115,12 +409,105 @@ def get_solver_resualt_endpoint(solver_resualt_id: int, session: SessionDep):
         return JSONResponse(
             status_code=404, content={"message": "Solver result not found"}
         )
-    return solver_resualt
+    return SolverHistoryResualtRead(
+        **solver_resualt.model_dump(include={"id", "name", "created_at"}),
+        resualt=read_solutions(solver_resualt),
+    )
+
+
+@router.get(
+    "/resualt/{solver_resualt_id}/solutions/{index}",
+    response_model=SolverSolution,
+    responses={
+        404: {"description": "Solver result not found", "model": Error404Response},
+    },
+)
+def get_solver_resualt_solution_endpoint(
+    solver_resualt_id: int,
+    index: int,
+    session: SessionDep,
+    group_id: int | None = None,
+    major_id: int | None = None,
+    professor_id: int | None = None,
+    classroom_id: int | None = None,
+):
+    """Solution index (0 based) of a stored result, only with the courses of the given
+    group, major, professor and classroom"""
+    solver_resualt = get_solver_resualt(session, solver_resualt_id)
+    if not solver_resualt:
+        return JSONResponse(
+            status_code=404, content={"message": "Solver result not found"}
+        )
+    filters = {
+        "group_id": group_id,
+        "major_id": major_id,
+        "professor_id": professor_id,
+        "classroom_id": classroom_id,
+    }
+    solution = read_solution(
+        solver_resualt,
+        index,
+        {field: value for field, value in filters.items() if value is not None},
+    )
+    if solution is None:
+        return JSONResponse(status_code=404, content={"message": "Solution not found"})
+    return solution
+
+
+@router.get(
+    "/resualt/{solver_resualt_id}/solutions/{index}/diff",
+    response_model=SolverSolutionDiff,
+    responses={
+        404: {"description": "Solver result not found", "model": Error404Response},
+    },
+)
+def diff_solver_resualt_solutions_endpoint(
+    solver_resualt_id: int,
+    index: int,
+    session: SessionDep,
+    other_index: int,
+    other_resualt_id: Annotated[
+        int | None, Query(description="defaults to the same result")
+    ] = None,
+):
+    """Courses that got another day, time or professor in solution other_index
+    (of other_resualt_id) compared to solution index"""
+    solver_resualt = get_solver_resualt(session, solver_resualt_id)
+    other_resualt = (
+        solver_resualt
+        if other_resualt_id is None
+        else get_solver_resualt(session, other_resualt_id)
+    )
+    if not solver_resualt or not other_resualt:
+        return JSONResponse(
+            status_code=404, content={"message": "Solver result not found"}
+        )
+    diff = diff_solutions(solver_resualt, index, other_resualt, other_index)
+    if diff is None:
+        return JSONResponse(status_code=404, content={"message": "Solution not found"})
+    return diff
 
 
 @router.get("/resualt/", response_model=list[SolverHistoryResualtReadLight])
-def list_solver_resualts_endpoint(session: SessionDep):
-    return list_solver_resualts(session)
+def list_solver_resualts_endpoint(
+    session: SessionDep,
+    limit: Annotated[int, Query(ge=1, le=500)] = 50,
+    before_id: Annotated[
+        int | None, Query(description="id of the last result of the previous page")
+    ] = None,
+    name: Annotated[str | None, Query(description="part of the name")] = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    """Newest first, pass the id of the last result as before_id to get the next page"""
+    return list_solver_resualts(
+        session,
+        limit=limit,
+        before_id=before_id,
+        name=name,
+        created_from=created_from,
+        created_to=created_to,
+    )
 
 
 @router.delete(
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import Enum
 from typing import Any, ClassVar
 
 from pydantic import BaseModel, Field, field_validator
@@ -60,7 +61,7 @@ class Courses(BaseModel):
     max_classes: int  # to determine the maximume of this kind of class at the same time
     time_slots: list[
         CourceTimeSlots
-    ]  # convert the basic professor times to time slots for courses
+    ]  # convert the basic professor times to time slots for courses, the parser leaves it empty and returns a SlotTable
     group_id: int  # major_id * 10 + semester, need to be uniqe among all courses
     major_name: str
     classroom_name: str
@@ -69,12 +70,34 @@ class Courses(BaseModel):
         return hash(self.id)
 
 
+class SolverSearchStrategy(str, Enum):
+    AUTOMATIC = "automatic"
+    FIXED = "fixed"  # branch on the variables in the order they are created
+    PORTFOLIO = "portfolio"
+    PREFERRED_FIRST = "preferred_first"  # try the prefered time slots before the rest
+
+
 class SolverSettings(BaseModel):
     number_of_solutions: int = Field(gt=0)
     classroom_limitation: bool = True
     professor_min_max_time_limitation: bool = True
     solver_resualt_name: str
     debug:bool=False
+    # cp-sat search parameters, they are capped by the server settings
+    num_workers: int | None = Field(default=None, gt=0)  # None means the cpu quota
+    max_time_in_seconds: float | None = Field(default=None, gt=0)
+    # anytime mode, the best solutions found within this many seconds (from the start of the
+    # job) are returned, with the objective bound and gap when the optimum is not proven
+    latency_budget_seconds: float | None = Field(default=None, gt=0)
+    random_seed: int | None = Field(default=None, ge=0, lt=2**31)
+    relative_gap_limit: float | None = Field(default=None, ge=0, le=1)
+    search_strategy: SolverSearchStrategy = SolverSearchStrategy.AUTOMATIC
+    # solve the parts of the catalog that share no group, professor or classroom separately
+    decompose: bool = True
+    # keep the courses not affected by the changes since the last result in their slot
+    incremental: bool = False
+    # hint cp-sat with a greedy timetable, also returned if the search finds none in time
+    heuristic: bool = True
 
 class SolverInputData(BaseModel):
     courses: list[Courses]
@@ -92,6 +115,8 @@ class SolverCourseSelectedDate(BaseModel):
     @field_validator("start_time", "end_time", mode="before")
     @classmethod
     def normalize_time(cls, value: Any) -> str:
+        if ":" in value:  # already hh:mm, e.g. when read back from the history
+            return value
         return f"{value[:2]}:{value[2:]}"
 
 
@@ -103,14 +128,41 @@ class SolverSolutionCourse(Courses):
         fields = {"time_slots": {"exclude": True}}
 
 
+class SolverSolutionScore(BaseModel):
+    total: float = 0  # 0 to 100, weighted sum of the metrics below, higher is better
+    preferred_ratio: float = 0  # courses in a prefered slot of their professor
+    professor_hours_in_range: float = 0  # professors between their min_hour and max_hour
+    professor_utilisation: float = 0  # mean taught hours / max_hour
+    daily_balance: float = 0  # 1 - mean coefficient of variation of the daily minutes of a group
+    idle_gap_minutes: float = 0  # mean idle minutes between the classes of a group in a day
+
+
 class SolverSolution(BaseModel):
     courses: list[SolverSolutionCourse]
+    score: SolverSolutionScore | None = None
+
+
+class SolverCourseDiff(BaseModel):
+    id: int
+    title: str
+    before: SolverCourseSelectedDate | None  # None if the course is not in the first solution
+    after: SolverCourseSelectedDate | None  # None if the course is not in the second solution
+
+
+class SolverSolutionDiff(BaseModel):
+    courses: list[SolverCourseDiff]  # courses with a different day, time or professor
+    unchanged: int
 
 
 class SolverResualt(BaseModel):
     Solutions: list[SolverSolution]
     settings: SolverSettings
     solver_resualt_history: "SolverHistoryResualtReadLight"
+    # of the best solution, the number of courses in a prefered slot
+    objective: float | None = None
+    bound: float | None = None
+    gap: float | None = None
+    optimal: bool | None = None  # False if the time ran out before the optimum was proven
 
 
 class SolverHistoryResualtBase(BaseModel):
@@ -146,3 +198,45 @@ class SolverHistoryResualtReadLight(SolverHistoryResualtBase):
     @classmethod
     def convert_to_local_tz(cls, value: datetime) -> datetime:
         return value.replace(tzinfo=timezone("UTC")).astimezone(timezone("Asia/Tehran"))
+
+
+class SolverJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class SolverQueueRead(BaseModel):
+    running: int
+    queued: int
+    pool_size: int  # solves that run at once
+    queue_size: int  # jobs that can wait, more are rejected
+    workers_per_solve: int
+
+
+class SolverPhaseTiming(BaseModel):
+    phase: str
+    seconds: float
+
+
+class SolverJobRead(BaseModel):
+    job_id: str
+    name: str
+    status: SolverJobStatus
+    solutions_found: int
+    number_of_solutions: int
+    error: str | None = None
+    solver_resualt_id: int | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    objective: float | None = None
+    bound: float | None = None
+    gap: float | None = None
+    optimal: bool | None = None
+    # place in the queue while the job waits for a process, 1 is the next to start
+    queue_position: int | None = None
+    # duration of every phase of the request, the solve phases once the job finished
+    timings: list[SolverPhaseTiming] = []
@@ -0,0 +1,447 @@
+"""Solver benchmark, times every phase of a solve on seeded instances.
+
+    python -m app.solver.benchmark --output benchmark.json
+    python -m app.solver.benchmark --baseline benchmark.json --threshold 0.2
+
+The generated instances go through the same path as the api (professor availability
+-> slot generation -> presolve -> model build -> solve -> scoring -> output), the
+bundled fixtures and MockData start from ready time slots. Caches are disabled so
+every run is cold. With a baseline the exit code is 1 when a phase got slower (or
+used more memory) than the threshold allows."""
+
+import argparse
+import json
+import logging
+import platform
+import random
+import resource
+import statistics
+import sys
+import tracemalloc
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+import numpy as np
+import ortools
+
+from app.schemas.classroom import ClassroomRead
+from app.schemas.course import CourseRead
+from app.schemas.major import MajorRead
+from app.schemas.professors import ProfessorRead, TimeSlot, Weekday
+from app.schemas.solver import CourceTimeSlots, SolverSettings
+from app.schemas.solver import Courses as SolverCourse
+from app.solver import data_2, data_min, data_min2
+from app.solver.cache import model_cache
+from app.solver.catalog import slot_catalog
+from app.solver.mock_data import MockData
+from app.solver.presolve import presolve
+from app.solver.scoring import score_solutions
+from app.solver.slots import SlotTable
+from app.solver.solver import ModelSolver
+from app.utils.parser import (
+    SolverOutputBuilder,
+    convert_course_read_list_to_solver_course_list,
+)
+from app.utils.system import available_cpus
+
+PHASES = (
+    "slot_generation",
+    "presolve",
+    "model_build",
+    "solve",
+    "scoring",
+    "output",
+)
+
+
+@dataclass
+class Scale:
+    courses: int
+    professors: int
+    groups: int
+    density: float  # share of the week days a professor is available on
+
+
+SCALES = {
+    "small": Scale(courses=60, professors=20, groups=8, density=0.5),
+    "medium": Scale(courses=300, professors=80, groups=24, density=0.5),
+    "large": Scale(courses=1200, professors=250, groups=64, density=0.4),
+}
+FIXTURES = {
+    "data_min": data_min.COURSES,
+    "data_min2": data_min2.COURSES,
+    "data_2": data_2.COURSES,
+}
+SEMESTERS = 4  # semesters of every generated major, a group is a (major, semester)
+DAYS = [day for day in Weekday if day != Weekday.FRIDAY]
+
+
+def generate_instance(
+    scale: Scale, seed: int
+) -> tuple[list[CourseRead], dict[int, ProfessorRead]]:
+    """Courses and professors like the ones read from the db, the same seed always
+    gives the same instance"""
+    rng = random.Random(seed)
+    majors = [
+        MajorRead(id=i, name=f"major {i}", semesters=SEMESTERS)
+        for i in range(1, -(-scale.groups // SEMESTERS) + 1)
+    ]
+    classrooms = [
+        ClassroomRead(
+            id=i,
+            name=f"classroom {i}",
+            available_classes=max(2, scale.courses // (len(majors) * 15)),
+        )
+        for i in range(1, len(majors) + 1)
+    ]
+    professors: dict[int, ProfessorRead] = {}
+    for i in range(1, scale.professors + 1):
+        days = rng.sample(DAYS, max(1, round(scale.density * len(DAYS))))
+        professors[i] = ProfessorRead(
+            id=i,
+            full_name=f"professor {i}",
+            major_id=majors[i % len(majors)].id,
+            major=majors[i % len(majors)],
+            max_hour=40 if i % 4 == 0 else 0,
+            preferred_days=days[:1],
+            time_slots=[
+                TimeSlot(
+                    day=day,
+                    start_time=f"{rng.randint(8, 10):02}:00",
+                    end_time=f"{rng.randint(14, 18):02}:00",
+                )
+                for day in days
+            ],
+        )
+    courses: list[CourseRead] = []
+    for i in range(1, scale.courses + 1):
+        group = i % scale.groups
+        major = majors[group // SEMESTERS]
+        classroom = classrooms[group // SEMESTERS]
+        duration = "01:30" if i % 3 else "02:00"
+        courses.append(
+            CourseRead(
+                id=i,
+                title=f"course {i}",
+                units=3,
+                duration=duration,
+                semester=group % SEMESTERS + 1,
+                calculated_hours=Decimal("1.5") if i % 3 else Decimal("2"),
+                major_id=major.id,
+                classroom_id=classroom.id,
+                major=major,
+                classroom=classroom,
+                professors=[
+                    professors[x]
+                    for x in rng.sample(sorted(professors), rng.randint(2, 3))
+                ],
+            )
+        )
+    return courses, professors
+
+
+def fixture_instance(
+    courses: list[tuple[Any, list[str], int]],
+) -> tuple[list[SolverCourse], dict[int, ProfessorRead]]:
+    """Solver input of the fixtures format (course id, "day,start,end,professor,prefered"
+    time slots, group), the courses are numbered again since MockData repeats ids"""
+    major = MajorRead(id=1, name="major", semesters=SEMESTERS)
+    data: list[SolverCourse] = []
+    professor_ids: set[int] = set()
+    for index, (_, time_slots, group) in enumerate(courses, start=1):
+        slots = []
+        for time_slot in time_slots:
+            day, start_time, end_time, prof, prefered = time_slot.split(",")
+            professor_ids.add(int(prof))
+            slots.append(
+                CourceTimeSlots(
+                    day=int(day),
+                    start_time=start_time,
+                    end_time=end_time,
+                    prof=int(prof),
+                    original_start=start_time,
+                    prefered=prefered == "1",
+                )
+            )
+        data.append(
+            SolverCourse(
+                id=index,
+                title=f"course {index}",
+                units=3,
+                duration="01:30",
+                semester=1,
+                calculated_hours=150,
+                major_id=1,
+                classroom_id=1,
+                max_classes=len(courses),
+                time_slots=slots,
+                group_id=int(group),
+                major_name=major.name,
+                classroom_name="classroom",
+            )
+        )
+    professors = {
+        prof_id: ProfessorRead(
+            id=prof_id, full_name=f"professor {prof_id}", major_id=1, major=major
+        )
+        for prof_id in sorted(professor_ids)
+    }
+    return data, professors
+
+
+def _timed(function: Callable[[], Any]) -> tuple[Any, float]:
+    start = perf_counter()
+    output = function()
+    return output, perf_counter() - start
+
+
+def _peak_mb(function: Callable[[], Any]) -> float:
+    """Peak python and numpy memory of a call, measured apart from the timings"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def run_instance(
+    name: str,
+    generate: Callable[[], tuple[list[SolverCourse], SlotTable]],
+    professors: dict[int, ProfessorRead],
+    settings: SolverSettings,
+    repeat: int,
+) -> dict:
+    """Runs every phase repeat times, the median time of every phase is kept"""
+    times: dict[str, list[float]] = {phase: [] for phase in PHASES}
+    for _ in range(repeat):
+        (data, slots), seconds = _timed(generate)
+        times["slot_generation"].append(seconds)
+        (slots, presolve_report), seconds = _timed(
+            lambda: presolve(slots, professors, settings)
+        )
+        times["presolve"].append(seconds)
+        model_solver = ModelSolver(data, settings, professors, slots=slots)
+        (model, _), seconds = _timed(model_solver._build_model)
+        times["model_build"].append(seconds)
+        # the model is already built, the solve phase only times the search
+        model_solver._load_model = lambda model=model: model  # type: ignore
+        solutions, seconds = _timed(model_solver.solve_slots)
+        times["solve"].append(seconds)
+        scores, seconds = _timed(lambda: score_solutions(slots, solutions, professors))
+        times["scoring"].append(seconds)
+
+        def output() -> list[dict]:
+            builder = SolverOutputBuilder(data, professors)
+            return [
+                builder.solution([slots.key(i) for i in selected], score).model_dump(
+                    mode="json"
+                )
+                for selected, score in zip(solutions, scores)
+            ]
+
+        _, seconds = _timed(output)
+        times["output"].append(seconds)
+
+    peak_mb = {
+        "slot_generation": _peak_mb(generate),
+        "presolve": _peak_mb(lambda: presolve(slots, professors, settings)),
+        "model_build": _peak_mb(
+            ModelSolver(data, settings, professors, slots=slots)._build_model
+        ),
+        "output": _peak_mb(output),
+    }
+    return {
+        "name": name,
+        "courses": slots.course_count,
+        "professors": len(professors),
+        "groups": len(np.unique(slots.group_ids)),
+        "variables": presolve_report.variables_before,
+        "variables_after_presolve": presolve_report.variables_after,
+        "solutions": len(solutions),
+        "objective": model_solver.search.objective,
+        "bound": model_solver.search.bound,
+        "optimal": model_solver.search.optimal,
+        "phases": {
+            phase: {
+                "seconds": round(statistics.median(times[phase]), 4),
+                **({"peak_mb": round(peak_mb[phase], 2)} if phase in peak_mb else {}),
+            }
+            for phase in PHASES
+        },
+    }
+
+
+def compare(
+    results: dict, baseline: dict, threshold: float, min_seconds: float
+) -> list[str]:
+    """Phases slower (or using more memory) than the baseline by more than threshold,
+    time differences below min_seconds are taken as noise"""
+    regressions: list[str] = []
+    previous = {instance["name"]: instance for instance in baseline["instances"]}
+    for instance in results["instances"]:
+        if instance["name"] not in previous:
+            continue
+        for phase, current in instance["phases"].items():
+            before = previous[instance["name"]]["phases"].get(phase)
+            if before is None:
+                continue
+            if (
+                current["seconds"] > before["seconds"] * (1 + threshold)
+                and current["seconds"] - before["seconds"] > min_seconds
+            ):
+                regressions.append(
+                    f"{instance['name']} {phase}: {before['seconds']}s -> {current['seconds']}s"
+                )
+            if (
+                "peak_mb" in current
+                and "peak_mb" in before
+                and current["peak_mb"] > before["peak_mb"] * (1 + threshold)
+                and current["peak_mb"] - before["peak_mb"] > 1
+            ):
+                regressions.append(
+                    f"{instance['name']} {phase}: {before['peak_mb']}MB -> {current['peak_mb']}MB"
+                )
+    return regressions
+
+
+def _print_results(results: dict) -> None:
+    header = f"{'instance':<16}{'variables':>10}" + "".join(
+        f"{phase:>16}" for phase in PHASES
+    )
+    print(header)
+    for instance in results["instances"]:
+        print(
+            f"{instance['name']:<16}{instance['variables']:>10}"
+            + "".join(
+                f"{instance['phases'][phase]['seconds']:>15.3f}s" for phase in PHASES
+            )
+        )
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.solver.benchmark", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument(
+        "--scales",
+        default="small,medium,large",
+        help=f"comma separated generated scales, of {', '.join(SCALES)}",
+    )
+    parser.add_argument(
+        "--fixtures",
+        default="data_min,data_min2,data_2,mock",
+        help=f"comma separated fixtures, of {', '.join(FIXTURES)}, mock",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--solutions", type=int, default=1)
+    parser.add_argument("--time-limit", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--output", help="json file the results are written to")
+    parser.add_argument("--baseline", help="json results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed slowdown of a phase, 0.2 is 20%%",
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=0.05,
+        help="time differences below this are ignored",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    # every run is cold
+    model_cache.max_bytes = 0
+    slot_catalog.max_entries = 0
+    settings = SolverSettings(
+        number_of_solutions=args.solutions,
+        solver_resualt_name="benchmark",
+        max_time_in_seconds=args.time_limit,
+        num_workers=args.workers,
+        random_seed=args.seed,
+        decompose=False,
+    )
+    instances: list[dict] = []
+    for name in filter(None, args.fixtures.split(",")):
+        if name == "mock":
+            random.seed(args.seed)
+            courses = MockData(
+                num_courses=40, proffesor_cout=12, group_max=6
+            ).generate_data()
+        else:
+            courses = FIXTURES[name]
+        data, professors = fixture_instance(courses)
+        instances.append(
+            run_instance(
+                name,
+                lambda data=data: (data, SlotTable.from_courses(data)),
+                professors,
+                settings,
+                args.repeat,
+            )
+        )
+    for name in filter(None, args.scales.split(",")):
+        course_reads, professors = generate_instance(SCALES[name], args.seed)
+        instances.append(
+            run_instance(
+                name,
+                lambda course_reads=course_reads: (
+                    convert_course_read_list_to_solver_course_list(course_reads)
+                ),
+                professors,
+                settings,
+                args.repeat,
+            )
+        )
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "system": {
+            "python": platform.python_version(),
+            "ortools": ortools.__version__,
+            "numpy": np.__version__,
+            "cpus": available_cpus(),
+            # peak resident memory of the whole run, the cp-sat search included
+            "max_rss_mb": round(
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+            ),
+        },
+        "settings": {
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "solutions": args.solutions,
+            "time_limit": args.time_limit,
+            "workers": args.workers,
+        },
+        "instances": instances,
+    }
+    _print_results(results)
+    if args.output:
+        with Path(args.output).open("w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with Path(args.baseline).open() as file:
+            regressions = compare(
+                results, json.load(file), args.threshold, args.min_seconds
+            )
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import settings as app_settings
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import SolverSettings
+from app.solver.slots import SlotTable
+
+logger = logging.getLogger()
+
+
+def model_fingerprint(
+    slots: SlotTable,
+    professors: dict[int, ProfessorRead],
+    settings: SolverSettings,
+) -> str:
+    """Hash of everything the built cp model depends on, the bool variable of slot i
+    is variable i of the model so the slot order is part of the key"""
+    digest = hashlib.sha256()
+    for column in (
+        slots.course_ids,
+        slots.group_ids,
+        slots.classroom_ids,
+        slots.max_classes,
+        slots.hours,
+        slots.course,
+        slots.day,
+        slots.start,
+        slots.end,
+        slots.prof,
+        slots.prefered,
+    ):
+        digest.update(np.ascontiguousarray(column).tobytes())
+        digest.update(b"|")
+    for prof_id in np.unique(slots.prof).tolist():
+        digest.update(
+            f"{prof_id}:{professors[prof_id].min_hour}:{professors[prof_id].max_hour},".encode()
+        )
+    digest.update(
+        f"{settings.classroom_limitation}:{settings.professor_min_max_time_limitation}".encode()
+    )
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """On disk LRU cache of serialized cp models, the least recently used models
+    are removed once the directory is bigger than max_bytes"""
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.model"
+
+    def get(self, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+        model_path = self._path(key)
+        try:
+            proto = model_path.read_bytes()
+        except OSError:
+            return None
+        # the modification time is the last use of the entry
+        os.utime(model_path)
+        return proto
+
+    def put(self, key: str, proto: bytes) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._write(self._path(key), proto)
+            self._evict()
+        except OSError:
+            logger.exception("could not write the model cache")
+
+    def _write(self, path: Path, content: bytes) -> None:
+        # written to a temporary file and renamed, other processes never see half a file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        Path(temp_path).replace(path)
+
+    def _evict(self) -> None:
+        entries = list()
+        total = 0
+        for model_path in self.directory.glob("*.model"):
+            try:
+                stat = model_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, model_path))
+            total += stat.st_size
+        for _, size, model_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            model_path.unlink(missing_ok=True)
+            total -= size
+
+
+model_cache = ModelCache(
+    app_settings.solver_model_cache_dir, app_settings.solver_model_cache_max_bytes
+)
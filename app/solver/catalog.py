@@ -0,0 +1,164 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+import numpy as np
+from sqlmodel import Session
+
+from app.core.config import settings as app_settings
+from app.core.metrics import registry
+from app.crud.slot_catalog import (
+    create_slot_catalog_entries,
+    delete_slot_catalog_entries,
+    list_slot_catalog_entries,
+)
+from app.models.slot_catalog import SlotCatalogEntry
+from app.schemas.professors import ProfessorRead
+
+# professor id, availability hash, course duration (hh:mm)
+CatalogKey = tuple[int, str, str]
+
+
+def availability_hash(professor: ProfessorRead) -> str:
+    """Digest of everything the generated slots of a professor depend on"""
+    payload = json.dumps(
+        [
+            [
+                [slot.day.value, slot.start_time, slot.end_time]
+                for slot in professor.time_slots
+            ],
+            sorted(day.value for day in professor.preferred_days),
+        ],
+        separators=(",", ":"),
+    )
+    return hashlib.sha1(payload.encode(), usedforsecurity=False).hexdigest()
+
+
+class SlotCatalog:
+    """LRU of the generated time slots of each professor and course duration, optionally
+    backed by the slotcatalogentry table so the slots survive restarts.
+
+    The key holds the availability hash, so a changed professor never gets stale slots,
+    invalidate only frees the entries that can't be used anymore."""
+
+    def __init__(self, max_entries: int, persist: bool = False) -> None:
+        self.max_entries = max_entries
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[CatalogKey, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get_many(
+        self,
+        requests: list[tuple[ProfessorRead, str]],
+        loader: Callable[[ProfessorRead, str], np.ndarray],
+        session: Session | None = None,
+    ) -> dict[tuple[int, str], np.ndarray]:
+        """Returns the slots of every (professor, duration) pair by (professor id, duration),
+        the misses are read from the db table in one query and the rest are generated by
+        loader. The returned arrays are shared, they are read only"""
+        output: dict[tuple[int, str], np.ndarray] = {}
+        if not self.enabled:
+            for professor, duration in requests:
+                output[(professor.id, duration)] = loader(professor, duration)
+            return output
+        keys = [
+            ((professor.id, availability_hash(professor), duration), professor)
+            for professor, duration in requests
+        ]
+        missing: dict[CatalogKey, ProfessorRead] = {}
+        with self._lock:
+            for key, professor in keys:
+                slots = self._entries.get(key)
+                if slots is None:
+                    missing[key] = professor
+                    continue
+                self._entries.move_to_end(key)
+                output[(key[0], key[2])] = slots
+            self.hits += len(output)
+            self.misses += len(missing)
+        if not missing:
+            return output
+
+        found = self._load(missing, session)
+        generated: dict[CatalogKey, np.ndarray] = {
+            key: loader(professor, key[2])
+            for key, professor in missing.items()
+            if key not in found
+        }
+        self._store(generated, session)
+        found.update(generated)
+
+        with self._lock:
+            for key, slots in found.items():
+                slots.flags.writeable = False
+                self._entries[key] = slots
+                output[(key[0], key[2])] = slots
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return output
+
+    def _load(
+        self, missing: dict[CatalogKey, ProfessorRead], session: Session | None
+    ) -> dict[CatalogKey, np.ndarray]:
+        if not self.persist or session is None:
+            return {}
+        found: dict[CatalogKey, np.ndarray] = {}
+        professor_ids = list({key[0] for key in missing})
+        for entry in list_slot_catalog_entries(session, professor_ids):
+            key = (entry.professor_id, entry.availability_hash, entry.duration)
+            if key in missing:
+                found[key] = (
+                    np.frombuffer(entry.slots, dtype=np.int32)
+                    .reshape(-1, 5)
+                    .astype(np.int64)
+                )
+        return found
+
+    def _store(
+        self, generated: dict[CatalogKey, np.ndarray], session: Session | None
+    ) -> None:
+        if not generated or not self.persist or session is None:
+            return
+        create_slot_catalog_entries(
+            session,
+            [
+                SlotCatalogEntry(
+                    professor_id=professor_id,
+                    availability_hash=professor_hash,
+                    duration=duration,
+                    slots=slots.astype(np.int32).tobytes(),
+                )
+                for (professor_id, professor_hash, duration), slots in generated.items()
+            ],
+        )
+
+    def invalidate(self, professor_id: int, session: Session | None = None) -> None:
+        """Drops the slots of a professor, called when its availability changes"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == professor_id]:
+                del self._entries[key]
+        if self.persist and session is not None:
+            delete_slot_catalog_entries(session, professor_id)
+
+
+slot_catalog = SlotCatalog(
+    app_settings.solver_slot_catalog_size, app_settings.solver_slot_catalog_persist
+)
+registry.counter(
+    "solver_slot_catalog_hits_total",
+    "Professor slots read from the slot catalog",
+    function=lambda: slot_catalog.hits,
+)
+registry.counter(
+    "solver_slot_catalog_misses_total",
+    "Professor slots generated or loaded from the db",
+    function=lambda: slot_catalog.misses,
+)
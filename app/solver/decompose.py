@@ -0,0 +1,55 @@
+import numpy as np
+
+from app.schemas.solver import SolverSettings
+from app.solver.slots import SlotTable
+
+
+def _find(parent: list[int], i: int) -> int:
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def split_components(slots: SlotTable, settings: SolverSettings) -> list[np.ndarray]:
+    """Splits the courses into groups that share no group, professor or classroom,
+    each group (an array of course positions) can be solved as its own model"""
+    parent = list(range(slots.course_count))
+    # first course index that used each resource
+    owners: dict[tuple[str, int], int] = {}
+
+    def link(resource: tuple[str, int], index: int) -> None:
+        owner = owners.setdefault(resource, index)
+        root_a, root_b = _find(parent, owner), _find(parent, index)
+        if root_a != root_b:
+            parent[root_b] = root_a
+
+    for index, group_id in enumerate(slots.group_ids.tolist()):
+        link(("group", group_id), index)
+    if settings.classroom_limitation:
+        for index, classroom_id in enumerate(slots.classroom_ids.tolist()):
+            link(("classroom", classroom_id), index)
+    # every (course, professor) pair once
+    pairs = np.unique(np.stack([slots.course.astype(np.int64), slots.prof]), axis=1)
+    for index, prof_id in pairs.T.tolist():
+        link(("professor", prof_id), index)
+
+    components: dict[int, list[int]] = {}
+    for index in range(slots.course_count):
+        components.setdefault(_find(parent, index), []).append(index)
+    return [np.array(component) for component in components.values()]
+
+
+def balance_components(
+    slots: SlotTable, components: list[np.ndarray], buckets: int
+) -> list[list[np.ndarray]]:
+    """Spreads the components over the buckets by their number of time slots (largest first)"""
+    counts = slots.slot_counts()
+    sizes = [int(counts[component].sum()) for component in components]
+    loads = [0] * buckets
+    output: list[list[np.ndarray]] = [[] for _ in range(buckets)]
+    for size, component in sorted(zip(sizes, components), key=lambda x: -x[0]):
+        bucket = loads.index(min(loads))
+        output[bucket].append(component)
+        loads[bucket] += size
+    return [bucket for bucket in output if bucket]
@@ -0,0 +1,145 @@
+import numpy as np
+
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import SolverSettings
+from app.solver.slots import MINUTES_PER_DAY, SlotTable
+
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+class _Resource:
+    """Groups, professors or classrooms: the resource of every slot, the capacity of
+    every resource and its minutes in use"""
+
+    def __init__(
+        self,
+        index: np.ndarray,
+        capacity: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+    ) -> None:
+        self.index = index
+        self.capacity = capacity
+        order = np.argsort(index, kind="stable")
+        bounds = np.searchsorted(index[order], np.arange(len(capacity) + 1))
+        # slot positions of every resource
+        self.members = [order[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        self.usage: dict[int, np.ndarray] = {}
+        # slots of the same resource overlapping every slot, divided by the capacity
+        self.pressure = np.zeros(len(index))
+        for resource, members in enumerate(self.members):
+            starts, ends = np.sort(start[members]), np.sort(end[members])
+            self.pressure[members] = (
+                np.searchsorted(starts, end[members])
+                - np.searchsorted(ends, start[members], side="right")
+            ) / capacity[resource]
+
+    def take(self, slot: int, start: np.ndarray, end: np.ndarray) -> np.ndarray | None:
+        """Uses the resource of slot for its interval, returns the slots that don't fit
+        anymore"""
+        resource = int(self.index[slot])
+        s, e = int(start[slot]), int(end[slot])
+        usage = self.usage.setdefault(
+            resource, np.zeros(MINUTES_PER_WEEK, dtype=np.int32)
+        )
+        usage[s:e] += 1
+        full = usage[s:e] >= self.capacity[resource]
+        if not full.any():
+            return None
+        members = self.members[resource]
+        overlap = members[(start[members] < e) & (end[members] > s)]
+        # full minutes between the overlapping part of each slot and this one
+        full_minutes = np.concatenate([[0], np.cumsum(full)])
+        low = np.maximum(start[overlap], s) - s
+        high = np.minimum(end[overlap], e) - s
+        return overlap[full_minutes[high] > full_minutes[low]]
+
+
+def greedy_assignment(
+    slots: SlotTable,
+    professors: dict[int, ProfessorRead],
+    settings: SolverSettings,
+) -> tuple[list[int], bool]:
+    """DSATUR like greedy timetable: the course with the fewest slots left is placed
+    first, in a free prefered slot if it has one, else in the slot that competes with
+    the least other slots for its group, professor and classroom.
+
+    Returns the selected slot positions of the courses it could place and whether that
+    is a full feasible solution of the model (every course placed, the professor
+    minimum hours met)"""
+    courses = slots.course_count
+    if courses == 0 or len(slots) == 0:
+        return [], False
+    course = slots.course
+    start = slots.week_start()
+    end = start + (slots.end - slots.start).astype(np.int64)
+
+    resources = [
+        _Resource(
+            np.unique(slots.group_ids, return_inverse=True)[1][course],
+            np.ones(len(np.unique(slots.group_ids))),
+            start,
+            end,
+        )
+    ]
+    prof_ids, prof_index = np.unique(slots.prof, return_inverse=True)
+    resources.append(_Resource(prof_index, np.ones(len(prof_ids)), start, end))
+    if settings.classroom_limitation:
+        classroom_ids, classroom_course = np.unique(
+            slots.classroom_ids, return_inverse=True
+        )
+        classroom_index = classroom_course[course]
+        # the model takes the capacity of a classroom from its first course
+        first = np.unique(classroom_index, return_index=True)[1]
+        capacity = np.zeros(len(classroom_ids))
+        capacity[classroom_index[first]] = slots.max_classes[course[first]]
+        resources.append(_Resource(classroom_index, capacity, start, end))
+    pressure = sum(resource.pressure for resource in resources)
+
+    min_hours = np.zeros(len(prof_ids), dtype=np.int64)
+    max_hours = np.zeros(len(prof_ids), dtype=np.int64)
+    if settings.professor_min_max_time_limitation:
+        for i, prof_id in enumerate(prof_ids.tolist()):
+            min_hours[i] = professors[prof_id].min_hour * 100
+            max_hours[i] = professors[prof_id].max_hour * 100
+    hours_used = np.zeros(len(prof_ids), dtype=np.int64)
+    slot_hours = slots.hours[course]
+    prof_members = resources[1].members
+
+    blocked = np.zeros(len(slots), dtype=np.bool_)
+    remaining = slots.slot_counts().astype(np.int64)
+    placed = np.zeros(courses, dtype=np.bool_)
+    selected: list[int] = []
+    unplaced = 0
+    for _ in range(courses):
+        index = int(np.argmin(np.where(placed, np.iinfo(np.int64).max, remaining)))
+        placed[index] = True
+        if remaining[index] == 0:
+            unplaced += 1
+            continue
+        options = np.arange(slots.offsets[index], slots.offsets[index + 1])
+        options = options[~blocked[options]]
+        slot = int(
+            options[np.lexsort((pressure[options], ~slots.prefered[options]))[0]]
+        )
+        selected.append(slot)
+
+        newly = [
+            x
+            for x in (resource.take(slot, start, end) for resource in resources)
+            if x is not None
+        ]
+        prof = prof_index[slot]
+        hours_used[prof] += slot_hours[slot]
+        if max_hours[prof] > 0:
+            members = prof_members[prof]
+            newly.append(
+                members[slot_hours[members] + hours_used[prof] > max_hours[prof]]
+            )
+        if newly:
+            blocked_now = np.unique(np.concatenate(newly))
+            blocked_now = blocked_now[~blocked[blocked_now]]
+            blocked[blocked_now] = True
+            remaining -= np.bincount(course[blocked_now], minlength=courses)
+    feasible = unplaced == 0 and bool((hours_used >= min_hours).all())
+    return sorted(selected), feasible
@@ -0,0 +1,121 @@
+import hashlib
+
+import numpy as np
+
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import SolverSettings
+from app.solver.slots import SlotTable
+
+# day, start time (hhmm), end time (hhmm), professor id
+SelectedSlot = tuple[int, str, str, int]
+
+
+def input_fingerprints(slots: SlotTable, professors: dict[int, ProfessorRead]) -> dict:
+    """Per course and per professor digests of the solver input, stored with the result
+    so the next incremental solve can tell what changed"""
+    rows = np.column_stack(
+        [slots.day, slots.start, slots.end, slots.prof, slots.prefered]
+    ).astype(np.int64)
+    offsets: list[int] = slots.offsets.tolist()
+    courses: dict[str, str] = {}
+    for index, course_id in enumerate(slots.course_ids.tolist()):
+        digest = hashlib.sha1(usedforsecurity=False)
+        digest.update(
+            np.array(
+                [
+                    slots.group_ids[index],
+                    slots.classroom_ids[index],
+                    slots.max_classes[index],
+                    slots.hours[index],
+                ],
+                dtype=np.int64,
+            ).tobytes()
+        )
+        # the slots of the table are sorted, the same input always gives the same bytes
+        digest.update(rows[offsets[index] : offsets[index + 1]].tobytes())
+        courses[str(course_id)] = digest.hexdigest()
+    return {
+        "courses": courses,
+        "professors": {
+            str(prof.id): [prof.min_hour, prof.max_hour] for prof in professors.values()
+        },
+    }
+
+
+def _is_fingerprints(value: object) -> bool:
+    """Fingerprints in the shape input_fingerprints returns them"""
+    return (
+        isinstance(value, dict)
+        and isinstance(value.get("courses"), dict)
+        and isinstance(value.get("professors"), dict)
+    )
+
+
+def _selected_slots(solution: dict) -> dict[int, SelectedSlot]:
+    selected: dict[int, SelectedSlot] = {}
+    for course in solution["courses"]:
+        slot = course["selected_slot"]
+        selected[course["id"]] = (
+            slot["day"],
+            slot["start_time"].replace(":", ""),
+            slot["end_time"].replace(":", ""),
+            slot["professor_id"],
+        )
+    return selected
+
+
+def plan_incremental(
+    slots: SlotTable,
+    settings: SolverSettings,
+    fingerprints: dict,
+    previous_fingerprints: dict,
+    previous_solution: dict,
+) -> dict[int, SelectedSlot]:
+    """Returns the previous slot of every course that is not affected by the changes,
+    a course is affected if it changed or shares a group, professor or classroom with one that did.
+    Malformed previous fingerprints keep nothing in place"""
+    if not _is_fingerprints(previous_fingerprints):
+        return {}
+    previous_slots = _selected_slots(previous_solution)
+    previous_courses = previous_fingerprints.get("courses", {})
+    previous_professors = previous_fingerprints.get("professors", {})
+    changed_professors = {
+        int(prof_id)
+        for prof_id, limits in fingerprints["professors"].items()
+        if previous_professors.get(prof_id) != limits
+    }
+    course_ids: list[int] = slots.course_ids.tolist()
+    course_professors: list[set[int]] = [set() for _ in course_ids]
+    pairs = np.unique(np.stack([slots.course.astype(np.int64), slots.prof]), axis=1)
+    for index, prof_id in pairs.T.tolist():
+        course_professors[index].add(prof_id)
+    changed: list[int] = [
+        index
+        for index, course_id in enumerate(course_ids)
+        if course_id not in previous_slots
+        or previous_courses.get(str(course_id))
+        != fingerprints["courses"][str(course_id)]
+        or course_professors[index] & changed_professors
+    ]
+
+    group_ids: list[int] = slots.group_ids.tolist()
+    classroom_ids: list[int] = slots.classroom_ids.tolist()
+    groups = {group_ids[index] for index in changed}
+    classrooms = {classroom_ids[index] for index in changed}
+    professors = set().union(*(course_professors[index] for index in changed))
+    # the professor that used to teach a changed course may now be free for others
+    professors.update(
+        previous_slots[course_ids[index]][3]
+        for index in changed
+        if course_ids[index] in previous_slots
+    )
+    warm_start: dict[int, SelectedSlot] = {}
+    for index, course_id in enumerate(course_ids):
+        if course_id not in previous_slots or group_ids[index] in groups:
+            continue
+        if settings.classroom_limitation and classroom_ids[index] in classrooms:
+            continue
+        if course_professors[index] & professors:
+            continue
+        warm_start[course_id] = previous_slots[course_id]
+    return warm_start
@@ -0,0 +1,99 @@
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import SolverSettings
+from app.solver.slots import SlotTable
+
+
+@dataclass
+class PresolveReport:
+    """Model size before and after the presolve, every time slot is one bool variable
+    and one optional interval in ModelSolver"""
+
+    courses: int = 0
+    variables_before: int = 0
+    variables_after: int = 0
+    duplicate_slots: int = 0  # same time and professor, the not prefered one is dropped
+    max_hour_slots: int = 0  # professor max_hour is less than the course hours
+    symmetric_slots: int = 0  # interchangeable professors at the same time
+
+    def asdict(self) -> dict:
+        return asdict(self)
+
+
+def _first_of_runs(slots: np.ndarray, columns: list[np.ndarray]) -> np.ndarray:
+    """Mask of the slots (already sorted by columns) that start a run of equal columns"""
+    first = np.zeros(len(slots), dtype=np.bool_)
+    first[:1] = True
+    for column in columns:
+        values = column[slots]
+        first[1:] |= values[1:] != values[:-1]
+    return first
+
+
+def presolve(
+    slots: SlotTable,
+    professors: dict[int, ProfessorRead],
+    settings: SolverSettings,
+) -> tuple[SlotTable, PresolveReport]:
+    """Drops the time slots that can't change the solutions before the cp model is built"""
+    report = PresolveReport(courses=slots.course_count, variables_before=len(slots))
+    course = slots.course.astype(np.int64)
+    slot_time = [course, slots.day, slots.start, slots.end]
+
+    # duplicate and dominated slots, a prefered slot is always at least as good as the same slot not prefered
+    kept = np.lexsort(
+        (~slots.prefered, slots.prof, slots.end, slots.start, slots.day, course)
+    )
+    first = _first_of_runs(kept, [*slot_time, slots.prof])
+    report.duplicate_slots = int((~first).sum())
+    kept = kept[first]
+
+    prof_ids = np.unique(slots.prof).tolist()
+    if settings.professor_min_max_time_limitation:
+        max_hours = {
+            prof_id: professors[prof_id].max_hour if prof_id in professors else 0
+            for prof_id in prof_ids
+        }
+        max_hour = np.array(
+            [max_hours[x] for x in slots.prof[kept].tolist()], dtype=np.int64
+        )
+        # the professor can never teach this course
+        too_long = (max_hour > 0) & (slots.hours[course[kept]] > max_hour * 100)
+        report.max_hour_slots = int(too_long.sum())
+        kept = kept[~too_long]
+
+    # professors that only teach this course (and have no min hours to reach) only interact
+    # with the rest of the model through this course, so they are interchangeable at the same time
+    pairs = np.unique(np.stack([slots.prof, course]), axis=1)
+    teaching, course_count = np.unique(pairs[0], return_counts=True)
+    private_professors = [
+        prof_id
+        for prof_id in teaching[course_count == 1].tolist()
+        if not settings.professor_min_max_time_limitation
+        or (prof_id in professors and professors[prof_id].min_hour == 0)
+    ]
+    private = np.isin(slots.prof[kept], private_professors)
+    shared_slots, private_slots = kept[~private], kept[private]
+    private_slots = private_slots[
+        np.lexsort(
+            (
+                slots.prof[private_slots],
+                ~slots.prefered[private_slots],
+                *(column[private_slots] for column in reversed(slot_time)),
+            )
+        )
+    ]
+    first = _first_of_runs(private_slots, slot_time)
+    report.symmetric_slots = int((~first).sum())
+    kept = np.concatenate([shared_slots, private_slots[first]])
+
+    kept = kept[
+        np.lexsort(
+            (slots.prof[kept], *(column[kept] for column in reversed(slot_time)))
+        )
+    ]
+    report.variables_after = len(kept)
+    return slots.take(kept), report
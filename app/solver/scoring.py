@@ -0,0 +1,103 @@
+import numpy as np
+
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import SolverSolutionScore
+from app.solver.slots import SlotTable
+
+DAYS = 7
+# weights of the metrics in the total score
+WEIGHTS = {
+    "preferred_ratio": 0.4,
+    "professor_hours_in_range": 0.2,
+    "daily_balance": 0.2,
+    "idle_gaps": 0.2,
+}
+# mean idle minutes per group and day that halve the idle gap part of the total
+IDLE_GAP_SCALE = 60
+
+
+def score_solutions(
+    slots: SlotTable,
+    solutions: list[list[int]],
+    professors: dict[int, ProfessorRead],
+) -> list[SolverSolutionScore]:
+    """Scores every solution (the selected slot positions, one per course) in one pass
+    over the solution x course matrix of the selected slots"""
+    if not solutions or slots.course_count == 0:
+        return [SolverSolutionScore() for _ in solutions]
+    selected = np.sort(np.array(solutions, dtype=np.int64), axis=1)
+    count = len(selected)
+    solution = np.arange(count)[:, None]
+    course = slots.course[selected]
+
+    preferred_ratio = slots.prefered[selected].mean(axis=1)
+
+    # hours of every professor of the table in every solution
+    prof_ids, prof_index = np.unique(slots.prof, return_inverse=True)
+    taught = (
+        np.bincount(
+            (solution * len(prof_ids) + prof_index[selected]).ravel(),
+            weights=slots.hours[course].ravel(),
+            minlength=count * len(prof_ids),
+        ).reshape(count, -1)
+        / 100
+    )
+    min_hour = np.array(
+        [professors[x].min_hour if x in professors else 0 for x in prof_ids.tolist()]
+    )
+    max_hour = np.array(
+        [professors[x].max_hour if x in professors else 0 for x in prof_ids.tolist()]
+    )
+    in_range = (taught >= min_hour) & ((max_hour == 0) | (taught <= max_hour))
+    limited = max_hour > 0
+    utilisation = (
+        (taught[:, limited] / max_hour[limited]).mean(axis=1)
+        if limited.any()
+        else np.zeros(count)
+    )
+
+    # minutes of every group in every day, only the days the group can have classes on count
+    group_ids, group_index = np.unique(slots.group_ids, return_inverse=True)
+    groups = len(group_ids)
+    start = slots.start[selected].astype(np.int64)
+    end = slots.end[selected].astype(np.int64)
+    cell = (solution * groups + group_index[course]) * DAYS + slots.day[selected]
+    load = np.bincount(
+        cell.ravel(), weights=(end - start).ravel(), minlength=count * groups * DAYS
+    ).reshape(count, groups, DAYS)
+    open_days = np.zeros((groups, DAYS), dtype=np.bool_)
+    open_days[group_index[slots.course], slots.day] = True
+    days = np.maximum(open_days.sum(axis=1), 1)
+    mean = load.sum(axis=2) / days
+    deviation = np.sqrt(
+        (((load - mean[..., None]) ** 2) * open_days).sum(axis=2) / days
+    )
+    variation = np.divide(
+        deviation, mean, out=np.zeros_like(mean), where=mean > 0
+    )  # coefficient of variation of the daily minutes
+    daily_balance = (1 - np.minimum(variation, 1)).mean(axis=1)
+
+    # idle minutes between the classes of a group in a day
+    order = np.lexsort((start.ravel(), cell.ravel()))
+    cells, starts, ends = cell.ravel()[order], start.ravel()[order], end.ravel()[order]
+    gaps = np.where(cells[1:] == cells[:-1], np.maximum(starts[1:] - ends[:-1], 0), 0)
+    idle = np.bincount(cells[1:] // (groups * DAYS), weights=gaps, minlength=count)
+    idle_gap_minutes = idle / np.maximum((load > 0).sum(axis=(1, 2)), 1)
+
+    total = 100 * (
+        WEIGHTS["preferred_ratio"] * preferred_ratio
+        + WEIGHTS["professor_hours_in_range"] * in_range.mean(axis=1)
+        + WEIGHTS["daily_balance"] * daily_balance
+        + WEIGHTS["idle_gaps"] * IDLE_GAP_SCALE / (IDLE_GAP_SCALE + idle_gap_minutes)
+    )
+    return [
+        SolverSolutionScore(
+            total=round(float(total[i]), 2),
+            preferred_ratio=round(float(preferred_ratio[i]), 4),
+            professor_hours_in_range=round(float(in_range[i].mean()), 4),
+            professor_utilisation=round(float(utilisation[i]), 4),
+            daily_balance=round(float(daily_balance[i]), 4),
+            idle_gap_minutes=round(float(idle_gap_minutes[i]), 1),
+        )
+        for i in range(count)
+    ]
@@ -0,0 +1,173 @@
+import numpy as np
+
+from app.schemas.solver import Courses as SolverCourse
+from app.schemas.solver import minutes_to_time
+
+MINUTES_PER_DAY = 1440
+
+# course id, day, start time, end time, professor id, prefered
+VariableKey = tuple[int, int, str, str, int, bool]
+
+
+def hhmm_to_minutes(values: np.ndarray) -> np.ndarray:
+    return values // 100 * 60 + values % 100
+
+
+class SlotTable:
+    """Column storage of the courses and time slots used by the solver.
+
+    Course arrays are indexed by the position of the course in the solver input,
+    slot arrays by the position of the slot, which is also the index of its bool
+    variable in the cp model. Slots are sorted by course so the slots of course i
+    are ``offsets[i]:offsets[i + 1]``, times are minutes since midnight."""
+
+    __slots__ = (
+        "course_ids",
+        "group_ids",
+        "classroom_ids",
+        "max_classes",
+        "hours",
+        "course",
+        "day",
+        "start",
+        "end",
+        "prof",
+        "prefered",
+        "offsets",
+    )
+
+    def __init__(
+        self,
+        course_ids: np.ndarray,
+        group_ids: np.ndarray,
+        classroom_ids: np.ndarray,
+        max_classes: np.ndarray,
+        hours: np.ndarray,
+        course: np.ndarray,
+        day: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        prof: np.ndarray,
+        prefered: np.ndarray,
+    ) -> None:
+        self.course_ids = np.asarray(course_ids, dtype=np.int64)
+        self.group_ids = np.asarray(group_ids, dtype=np.int64)
+        self.classroom_ids = np.asarray(classroom_ids, dtype=np.int64)
+        self.max_classes = np.asarray(max_classes, dtype=np.int64)
+        self.hours = np.asarray(hours, dtype=np.int64)
+        self.course = np.asarray(course, dtype=np.int32)
+        self.day = np.asarray(day, dtype=np.int16)
+        self.start = np.asarray(start, dtype=np.int16)
+        self.end = np.asarray(end, dtype=np.int16)
+        self.prof = np.asarray(prof, dtype=np.int64)
+        self.prefered = np.asarray(prefered, dtype=np.bool_)
+        self.offsets = np.searchsorted(self.course, np.arange(len(self.course_ids) + 1))
+
+    @classmethod
+    def from_rows(cls, courses: list[SolverCourse], rows: np.ndarray) -> "SlotTable":
+        """Builds the table from the slot rows (course position, day, start, end, professor,
+        prefered), the rows have to be grouped by course in the order of the courses"""
+        return cls(
+            course_ids=[course.id for course in courses],
+            group_ids=[course.group_id for course in courses],
+            classroom_ids=[course.classroom_id for course in courses],
+            max_classes=[course.max_classes for course in courses],
+            hours=[course.calculated_hours for course in courses],
+            course=rows[:, 0],
+            day=rows[:, 1],
+            start=rows[:, 2],
+            end=rows[:, 3],
+            prof=rows[:, 4],
+            prefered=rows[:, 5].astype(np.bool_),
+        )
+
+    @classmethod
+    def from_courses(cls, courses: list[SolverCourse]) -> "SlotTable":
+        """Converts the pydantic time slots of the courses"""
+        rows = np.array(
+            [
+                (
+                    index,
+                    slot.day,
+                    int(slot.start_time),
+                    int(slot.end_time),
+                    slot.prof,
+                    slot.prefered,
+                )
+                for index, course in enumerate(courses)
+                for slot in course.time_slots
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 6)
+        rows[:, 2] = hhmm_to_minutes(rows[:, 2])
+        rows[:, 3] = hhmm_to_minutes(rows[:, 3])
+        # sorted so the same input always gives the same table (and model)
+        return cls.from_rows(courses, rows[np.lexsort(rows.T[::-1])])
+
+    def __len__(self) -> int:
+        return len(self.course)
+
+    @property
+    def course_count(self) -> int:
+        return len(self.course_ids)
+
+    def slot_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def week_start(self) -> np.ndarray:
+        """Start of every slot in minutes since the start of the week"""
+        return self.day.astype(np.int64) * MINUTES_PER_DAY + self.start
+
+    def take(self, slots: np.ndarray) -> "SlotTable":
+        """Keeps the given slots (sorted by course) of all the courses"""
+        return SlotTable(
+            self.course_ids,
+            self.group_ids,
+            self.classroom_ids,
+            self.max_classes,
+            self.hours,
+            self.course[slots],
+            self.day[slots],
+            self.start[slots],
+            self.end[slots],
+            self.prof[slots],
+            self.prefered[slots],
+        )
+
+    def course_slots(self, courses: np.ndarray) -> np.ndarray:
+        """Positions of the slots of the given courses, in the order of the courses"""
+        return np.concatenate(
+            [np.arange(self.offsets[c], self.offsets[c + 1]) for c in courses.tolist()]
+            or [np.empty(0, dtype=np.int64)]
+        )
+
+    def select_courses(self, courses: np.ndarray) -> "SlotTable":
+        """The table of the given courses (sorted positions) and their slots"""
+        courses = np.asarray(courses, dtype=np.int64)
+        slots = self.course_slots(courses)
+        # position of the old course index in the new table
+        position = np.zeros(self.course_count, dtype=np.int32)
+        position[courses] = np.arange(len(courses))
+        return SlotTable(
+            self.course_ids[courses],
+            self.group_ids[courses],
+            self.classroom_ids[courses],
+            self.max_classes[courses],
+            self.hours[courses],
+            position[self.course[slots]],
+            self.day[slots],
+            self.start[slots],
+            self.end[slots],
+            self.prof[slots],
+            self.prefered[slots],
+        )
+
+    def key(self, slot: int) -> VariableKey:
+        return (
+            int(self.course_ids[self.course[slot]]),
+            int(self.day[slot]),
+            minutes_to_time(int(self.start[slot])),
+            minutes_to_time(int(self.end[slot])),
+            int(self.prof[slot]),
+            bool(self.prefered[slot]),
+        )
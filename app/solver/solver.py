@@ -1,22 +1,69 @@
 # ruff: noqa: C408
 import logging
+import multiprocessing
+import threading
 from collections import namedtuple
-from dataclasses import dataclass
-from itertools import groupby
-from operator import attrgetter
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from time import monotonic
+from time import time as wall_time
+from typing import Any
 
+import numpy as np
 from ortools.sat.python import cp_model
 
+from app.core.config import settings as app_settings
+from app.core.metrics import Spans, span
 from app.schemas.professors import ProfessorRead
-from app.schemas.solver import CourceTimeSlots as SolverCourseTimeSlot
 from app.schemas.solver import Courses as SolverCourse
-from app.schemas.solver import SolverSettings, convert_time_to_min
+from app.schemas.solver import (
+    SolverSearchStrategy,
+    SolverSettings,
+    convert_time_to_min,
+)
+from app.solver.cache import model_cache, model_fingerprint
+from app.solver.decompose import balance_components, split_components
+from app.solver.heuristic import greedy_assignment
+from app.solver.incremental import SelectedSlot
+from app.solver.scoring import score_solutions
+from app.solver.slots import SlotTable
+from app.utils.system import available_cpus
 
 # from data_min import COURSES
 # from data_min2 import COURSES
 
 logger = logging.getLogger()
 
+# share of the latency budget kept for collecting the rest of the solutions
+ENUMERATION_SHARE = 0.2
+# seconds between two checks of the cancel event while cp-sat searches
+CANCEL_POLL_SECONDS = 0.25
+
+
+@dataclass
+class SearchReport:
+    """Outcome of the optimization search, the objective is the number of prefered
+    slots of the best solution and bound the best proven upper bound of it. Also
+    holds the cp-sat statistics of all the searches, the size of the model and the
+    timing spans of the solve"""
+
+    objective: float = 0
+    bound: float = 0
+    optimal: bool = False
+    branches: int = 0
+    conflicts: int = 0
+    wall_time: float = 0
+    variables: int = 0
+    constraints: int = 0
+    spans: Spans = field(default_factory=list)
+
+    @property
+    def gap(self) -> float:
+        # relative gap, the same way cp-sat computes relative_gap_limit
+        return abs(self.bound - self.objective) / max(1.0, abs(self.objective))
+
 
 class ModelSolver:
     def __init__(
@@ -24,7 +71,11 @@ class ModelSolver:
         data: list[SolverCourse],
         settings: SolverSettings,
         professors: dict[int, ProfessorRead],
-        debug:bool=False
+        debug: bool = False,
+        reporter: Callable[[dict], None] | None = None,
+        warm_start: dict[int, SelectedSlot] | None = None,
+        slots: SlotTable | None = None,
+        cancel: Any = None,
     ) -> None:
         ids = set()
         for i in data:
@@ -33,180 +84,770 @@ class ModelSolver:
             else:
                 raise ValueError("There is a duplicate id among the courses")
         self.data: list[SolverCourse] = data
+        # compact copy of the courses and their time slots the model is built from,
+        # course i of the table is data[i]
+        self.slots: SlotTable = (
+            slots if slots is not None else SlotTable.from_courses(data)
+        )
         self.settings: SolverSettings = settings
-        self.soloutins: list[list[tuple[int, SolverCourseTimeSlot, int]]] = list()
         self.professors: dict[int, ProfessorRead] = professors
+        # called with a progress event dict, used by background jobs
+        self.reporter: Callable[[dict], None] | None = reporter
+        # previous slot of the courses an incremental solve keeps in place
+        self.warm_start: dict[int, SelectedSlot] = warm_start or {}
+        # monotonic time when the whole solve (all searches together) has to stop
+        self._deadline: float | None = None
+        # monotonic time when the optimization search has to stop in anytime mode
+        self._search_deadline: float | None = None
+        self.search = SearchReport()
+        # event (threading or multiprocessing manager) that stops the search when set,
+        # the solutions found until then are returned
+        self.cancel = cancel
+        # the running cp-sat search, stopped from the cancel watcher thread
+        self._solver: cp_model.CpSolver | None = None
+        self._solver_lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        if self.cancel is None:
+            return False
+        try:
+            return self.cancel.is_set()
+        except (EOFError, OSError):
+            # the server that owns the event shut down, nobody waits for the result
+            return True
+
+    @contextmanager
+    def _cancellation(self) -> Iterator[None]:
+        """Polls the cancel event in a thread and stops the running search once it is set,
+        cp-sat only calls back on solutions so it can't be checked from a callback"""
+        if self.cancel is None:
+            yield
+            return
+        done = threading.Event()
+
+        def watch() -> None:
+            while not done.wait(CANCEL_POLL_SECONDS):
+                if self.cancelled:
+                    # every tick, a search may have started right after the last stop
+                    with self._solver_lock:
+                        if self._solver is not None:
+                            self._solver.stop_search()
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            yield
+        finally:
+            done.set()
+            watcher.join()
+
+    def _max_workers(self) -> int:
+        max_workers = app_settings.solver_max_workers or available_cpus()
+        return min(self.settings.num_workers or max_workers, max_workers)
+
+    def _new_cp_solver(self, enumerate_all: bool = False) -> cp_model.CpSolver:
+        """Creates a CpSolver with the search parameters of the settings, capped by the server settings.
+        With enumerate_all it reports every solution, which cp-sat only does with one worker"""
+        solver = cp_model.CpSolver()
+        parameters = solver.parameters
+        parameters.num_workers = 1 if enumerate_all else self._max_workers()
+        parameters.enumerate_all_solutions = enumerate_all
+        if self._deadline is not None:
+            parameters.max_time_in_seconds = max(0.0, self._deadline - monotonic())
+        if self.settings.random_seed is not None:
+            parameters.random_seed = self.settings.random_seed
+        if self.settings.relative_gap_limit is not None:
+            parameters.relative_gap_limit = min(
+                self.settings.relative_gap_limit,
+                app_settings.solver_max_relative_gap_limit,
+            )
+        strategy = self.settings.search_strategy
+        if strategy.value not in app_settings.solver_allowed_search_strategies:
+            raise ValueError(f"Search strategy {strategy.value} is not allowed")
+        if strategy == SolverSearchStrategy.FIXED:
+            parameters.search_branching = cp_model.FIXED_SEARCH
+        elif strategy == SolverSearchStrategy.PORTFOLIO:
+            parameters.search_branching = cp_model.PORTFOLIO_SEARCH
+        elif strategy == SolverSearchStrategy.PREFERRED_FIRST:
+            # the decision strategy on the prefered slots is added to the model in solve()
+            parameters.search_branching = cp_model.FIXED_SEARCH
+        return solver
+
+    def _build_model(  # noqa: C901
+        self, diagnose: bool = False
+    ) -> tuple[cp_model.CpModel, dict[int, tuple[cp_model.IntVar, str]]]:
+        """Builds the cp model, when diagnose is set the group, professor, hours and
+        classroom constraints are guarded by an assumption literal (literal index ->
+        literal, error message).
 
-    def solve(self):  # noqa: C901
-        self.soloutins.clear()
+        The bool variable of slot i is variable i of the model and its optional interval
+        is constraint i, the bulk of the model is written to the proto directly since
+        the python wrappers of cp_model cost more than the whole build"""
+        slots = self.slots
+        empty = np.flatnonzero(slots.slot_counts() == 0)
+        if len(empty):
+            raise ValueError(f"Course {self.data[empty[0]]} dose not have any timeslot")
         model = cp_model.CpModel()
+        proto = model.proto
         # Model the problem
-        # the actual time intervals for each course time slots, it is then linked to bool_variables
-        courses_dict = {course.id: course for course in self.data}
-        interval_variables: dict[
-            tuple[int, SolverCourseTimeSlot], cp_model.IntervalVar
-        ] = {}
-        # basicly time slots that says what time slot is selected for the cours e
-        bool_variables: dict[tuple[int, SolverCourseTimeSlot], cp_model.IntVar] = {}
-        # list of time slots that are perefered
-        bool_variables_prefered: list[cp_model.IntVar] = list()
-        # Creat all Variables
-        for course in self.data:
-            course_times = list()
-            if len(course.time_slots) == 0:
-                raise ValueError(f"Course {course} dose not have any timeslot")
-            # create the bool and intvars from the courses and add them to the list
-            for time in course.time_slots:
-                bool_variables[(course.id, time)] = model.new_bool_var(
-                    name=f"bool_course_{course.id}_day_{time.day}_start_{time.start_time}_end_{time.end_time}_prof_{time.prof}_prefered_{time.prefered}"
-                )
-                if time.prefered:
-                    bool_variables_prefered.append(bool_variables[(course.id, time)])
-                model_start_time = convert_time_to_min(int(time.start_time))
-                model_end_time = convert_time_to_min(int(time.end_time))
-                interval_variables[(course.id, time)] = model.NewOptionalIntervalVar(
-                    start=int(str(time.day + 1) + str(model_start_time).zfill(4)),
-                    size=model_end_time - model_start_time,
-                    end=int(str(time.day + 1) + str(model_end_time).zfill(4)),
-                    is_present=bool_variables[(course.id, time)],
-                    name=f"bool_course_{course.id}_day_{time.day}_start_{str(time.start_time)}_end_{str(time.end_time)}_prof_{time.prof}_prefered_{time.prefered}",
-                )
-                course_times.append(bool_variables[(course.id, time)])
-            # select exactly 1 time per course‌ (basically you have to select a time for a course)
-            model.add_exactly_one(course_times)
-            if self.settings.debug:
-                solver = cp_model.CpSolver()
-                ans=solver.solve(model)
-                if ans!=4:
-                    raise ValueError(f"درس {course} باعث خرابی جواب میشود")
+        # basicly time slots that says what time slot is selected for the course
+        for _ in range(len(slots)):
+            proto.variables.add(domain=[0, 1])
+        # the actual time intervals (minutes since the start of the week) linked to the slot variables
+        starts: list[int] = slots.week_start().tolist()
+        sizes: list[int] = (slots.end - slots.start).tolist()
+        for i, (start, size) in enumerate(zip(starts, sizes)):
+            _add_interval(proto, i, start, size)
+        assumptions: dict[int, tuple[cp_model.IntVar, str]] = {}
+
+        def new_assumption(message: str) -> cp_model.IntVar | None:
+            if not diagnose:
+                return None
+            literal = model.new_bool_var(f"assumption_{len(assumptions)}")
+            assumptions[literal.index] = (literal, message)
+            return literal
+
+        def add_cumulative(
+            members: list[int],
+            capacity: int,
+            assumption: cp_model.IntVar | None,
+        ) -> None:
+            if assumption is None:
+                intervals = members
+            else:
+                # cumulative can't be enforced by a literal, so the intervals are copied
+                # with presence = selected and assumption
+                intervals = list()
+                for i in members:
+                    selected = model.get_bool_var_from_proto_index(i)
+                    present = model.new_bool_var(f"guarded_{assumption.index}_{i}")
+                    model.add_bool_and([selected, assumption]).only_enforce_if(present)
+                    model.add_bool_or([selected.Not(), assumption.Not(), present])
+                    intervals.append(
+                        _add_interval(proto, present.index, starts[i], sizes[i])
+                    )
+            constraint = proto.constraints.add()
+            if capacity == 1:
+                constraint.no_overlap.intervals.extend(intervals)
+                return
+            constraint.cumulative.intervals.extend(intervals)
+            for _ in intervals:
+                constraint.cumulative.demands.add(offset=1)
+            constraint.cumulative.capacity.offset = capacity
+
+        # select exactly 1 time per course‌ (basically you have to select a time for a course)
+        offsets: list[int] = slots.offsets.tolist()
+        # always hard, without it any conflict is solved by dropping the courses, so they
+        # would all land in the infeasible core (a course without slots is rejected above)
+        for index in range(len(self.data)):
+            course_times = range(offsets[index], offsets[index + 1])
+            proto.constraints.add().exactly_one.literals.extend(course_times)
         # Creat Group constraints (only 1 class blonging to a group (group_id calculated by semester and major id) can happen at a time)
-        group_data: dict[int, list[SolverCourse]] = {
-            group: list(items)
-            for group, items in groupby(
-                sorted(self.data, key=attrgetter("group_id")),
-                key=attrgetter("group_id"),
+        for group_id, members in _group_slots(slots.group_ids[slots.course]).items():
+            add_cumulative(
+                members,
+                1,
+                new_assumption(f"گروه {group_id} باعت خرابی جواب میشود"),
             )
-        }
-        for group_id in group_data.values():
-            group_intervals = list()
-            for course in group_id:
-                for time in course.time_slots:
-                    group_intervals.append(interval_variables[(course.id, time)])  # noqa: PERF401
-            demands = [1] * len(group_intervals)
-            model.add_cumulative(group_intervals, demands, 1)
-            if self.settings.debug:
-                solver = cp_model.CpSolver()
-                ans=solver.solve(model)
-                if ans!=4:
-                    raise ValueError(f"گروه {group_id} باعت خرابی جواب میشود")
         # Creat professor constraints (a professor cant teach > 1 class at the same time)
-        # tuple[solvercoursetimeslot,course_id]
-        professors_data: dict[int, list[tuple[SolverCourseTimeSlot, int]]] = {}
-        for prof, items in groupby(
-            sorted(
-                [
-                    (time, course.id)
-                    for course in self.data
-                    for time in course.time_slots
-                ],
-                key=lambda x: x[0].prof,
-            ),
-            key=lambda x: x[0].prof,
-        ):
-            professors_data[prof] = list(items)
-        for prof_id, val in professors_data.items():  # noqa: PERF102
-            professor_intervals = list()
-            for time, coruse_id in val:
-                professor_intervals.append(interval_variables[(coruse_id, time)])
-            demands = [1] * len(professor_intervals)
-            model.add_cumulative(professor_intervals, demands, 1)
-            if self.settings.debug:
-                solver = cp_model.CpSolver()
-                ans=solver.solve(model)
-                if ans!=4:
-                    raise ValueError(f"استاد با id {self.professors[prof_id]} باعث خرابی جواب میشود")
+        professors_data = _group_slots(slots.prof)
+        for prof_id, members in professors_data.items():
+            add_cumulative(
+                members,
+                1,
+                new_assumption(
+                    f"استاد با id {prof_id} ({self.professors[prof_id].full_name}) باعث خرابی جواب میشود"
+                ),
+            )
         # Min and max course hours for professor constraints, ensures is the professor has min max hourse > 0, that they are added to model constraints
         if self.settings.professor_min_max_time_limitation:
-            for prof_id, val in professors_data.items():
+            slot_hours: list[int] = slots.hours[slots.course].tolist()
+            for prof_id, members in professors_data.items():
                 professor_data: ProfessorRead = self.professors[prof_id]
                 prof_min_hour = professor_data.min_hour
                 prof_max_hour = professor_data.max_hour
                 if prof_max_hour == 0 and prof_min_hour == 0:
                     continue
 
-                bool_vars = []
-                hours = []
-                for slot, course_id in val:
-                    bool_vars.append(bool_variables[(course_id, slot)])
-                    hours.append(courses_dict[course_id].calculated_hours)
-                if prof_max_hour > 0:
-                    model.add(
-                        sum(bool_var * hour for bool_var, hour in zip(bool_vars, hours))
-                        <= prof_max_hour * 100
-                    )
+                hours = [slot_hours[i] for i in members]
+                assumption = new_assumption(
+                    f"محدودیت ساعت برای استاد {professor_data.full_name} باعث خرابی جواب میشود"
+                )
+                # min hours * 100 <= sum of the selected course hours <= max hours * 100,
+                # as two half bounded constraints so a minimum above the maximum or above
+                # all the courses of the professor is infeasible and not an invalid model
+                domains = list()
                 if prof_min_hour > 0:
-                    model.add(
-                        sum(bool_var * hour for bool_var, hour in zip(bool_vars, hours))
-                        >= prof_min_hour * 100
-                    )
-                if self.settings.debug:
-                    solver = cp_model.CpSolver()
-                    ans=solver.solve(model)
-                    if ans!=4:
-                        raise ValueError(f"محدودیت ساعت برای استاد {professor_data} باعث خرابی جواب میشود")
+                    domains.append([prof_min_hour * 100, cp_model.INT_MAX])
+                if prof_max_hour > 0:
+                    domains.append([cp_model.INT_MIN, prof_max_hour * 100])
+                for domain in domains:
+                    constraint = proto.constraints.add()
+                    if assumption is not None:
+                        constraint.enforcement_literal.append(assumption.index)
+                    constraint.linear.vars.extend(members)
+                    constraint.linear.coeffs.extend(hours)
+                    constraint.linear.domain.extend(domain)
         # Add constraints on maximum number on classes that need a spesicif classroom, like computer or architechture classrooms.
         if self.settings.classroom_limitation:
-            classroom_data: dict[int, list[SolverCourse]] = {
-                group: list(items)
-                for group, items in groupby(
-                    sorted(self.data, key=attrgetter("classroom_id")),
-                    key=attrgetter("classroom_id"),
+            for members in _group_slots(slots.classroom_ids[slots.course]).values():
+                course_index = int(slots.course[members[0]])
+                add_cumulative(
+                    members,
+                    int(slots.max_classes[course_index]),
+                    new_assumption(
+                        f"محدودیت کلاس برای کلاس های {self.data[course_index].classroom_name} باعث خرابی جواب میشود"
+                    ),
                 )
+        return model, assumptions
+
+    def diagnose(self) -> list[str]:
+        """Finds the constraints that make the model infeasible with a single solve,
+        using the infeasible core of the assumption literals"""
+        model, assumptions = self._build_model(diagnose=True)
+        model.add_assumptions([literal for literal, _ in assumptions.values()])
+        solver = self._new_cp_solver()
+        # the core is only reported reliably by the sequential search
+        solver.parameters.num_workers = 1
+        stat = self._search(solver, model, None, "diagnose")
+        if stat != cp_model.INFEASIBLE:
+            return []
+        return [
+            assumptions[index][1]
+            for index in solver.sufficient_assumptions_for_infeasibility()
+        ]
+
+    def solve_slots(self) -> list[list[int]]:
+        """Solves the model, every solution is the list of the selected slot positions,
+        best objective first"""
+        max_time = app_settings.solver_max_time_in_seconds
+        if self.settings.max_time_in_seconds is not None:
+            max_time = min(max_time, self.settings.max_time_in_seconds)
+        budget = self.settings.latency_budget_seconds
+        if budget is not None:
+            max_time = min(max_time, budget)
+        self._deadline = monotonic() + max_time
+        self._search_deadline = None
+        self.search = SearchReport()
+        if budget is not None and self.settings.number_of_solutions > 1:
+            # the best solution is searched first, leave time for finding the rest
+            self._search_deadline = self._deadline - max_time * ENUMERATION_SHARE
+        with self._cancellation():
+            if self.settings.decompose:
+                components = split_components(self.slots, self.settings)
+                if (
+                    len(components) > 1
+                    and len(self.slots) >= app_settings.solver_decompose_min_variables
+                ):
+                    return self._solve_components(components)
+            return self._solve_model()
+
+    def _report_solution(self, event_type: str, selected: list[int], **data) -> None:
+        if self.reporter is None:
+            return
+        score = score_solutions(self.slots, [selected], self.professors)[0]
+        self.reporter(
+            {
+                "type": event_type,
+                **data,
+                "solution": [self.slots.key(i) for i in selected],
+                "score": score.model_dump(),
             }
-            for courses in classroom_data.values():
-                classroom_intervals = list()
-                max_classes = 0
-                for course in courses:
-                    max_classes = course.max_classes
-                    for time in course.time_slots:
-                        classroom_intervals.append(  # noqa: PERF401
-                            interval_variables[(course.id, time)]
+        )
+
+    def _solve_components(self, components: list[np.ndarray]) -> list[list[int]]:
+        """Solves the independent parts of the problem in parallel processes and merges them,
+        solution i is made of solution i of every component (or its last one if it has less)"""
+        slots = self.slots
+        workers = self._max_workers()
+        buckets = balance_components(slots, components, min(len(components), workers))
+        # the cp-sat workers are divided between the processes
+        settings = self.settings.model_copy(
+            update={"decompose": False, "num_workers": max(1, workers // len(buckets))}
+        )
+        deadline = wall_time() + (self._deadline - monotonic())  # type: ignore
+        logger.info(
+            "solving %s components in %s processes", len(components), len(buckets)
+        )
+        results: list[tuple[list[list[int]], SearchReport]] = list()
+        if len(buckets) == 1:
+            # no cpu to spare, the smaller models are still solved faster one by one
+            parts = [self._component(courses) for courses in buckets[0]]
+            results = _solve_bucket(
+                parts, settings, self.professors, deadline, self.warm_start, self.cancel
+            )
+        else:
+            # spawn like the job pool, this process runs the cancel watcher thread and
+            # holds manager connections that a fork would copy in an unknown state
+            executor = ProcessPoolExecutor(
+                max_workers=len(buckets),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            try:
+                futures = list()
+                for bucket in buckets:
+                    parts = [self._component(courses) for courses in bucket]
+                    professors = {
+                        prof_id: self.professors[prof_id]
+                        for _, table in parts
+                        for prof_id in np.unique(table.prof).tolist()
+                    }
+                    warm_start = {
+                        course.id: self.warm_start[course.id]
+                        for data, _ in parts
+                        for course in data
+                        if course.id in self.warm_start
+                    }
+                    futures.append(
+                        executor.submit(
+                            _solve_bucket,
+                            parts,
+                            settings,
+                            professors,
+                            deadline,
+                            warm_start,
+                            self.cancel,
                         )
-                demands = [1] * len(classroom_intervals)
-                model.add_cumulative(classroom_intervals, demands, max_classes)
-                if self.settings.debug:
-                    solver = cp_model.CpSolver()
-                    ans=solver.solve(model)
-                    if ans!=4:
-                        raise ValueError(f"محدودیت کلاس برای کلاس های {course.classroom_name} باعث خرابی جواب میشود") # type: ignore
+                    )
+                for future in futures:
+                    results.extend(future.result())
+            finally:
+                executor.shutdown(cancel_futures=True)
+        reports = [search for _, search in results]
+        self.search = SearchReport(
+            objective=sum(search.objective for search in reports),
+            bound=sum(search.bound for search in reports),
+            optimal=all(search.optimal for search in reports),
+            branches=sum(search.branches for search in reports),
+            conflicts=sum(search.conflicts for search in reports),
+            wall_time=sum(search.wall_time for search in reports),
+            variables=sum(search.variables for search in reports),
+            constraints=sum(search.constraints for search in reports),
+            # the components of different processes ran at the same time
+            spans=[x for search in reports for x in search.spans],
+        )
+        if any(len(component_sols) == 0 for component_sols, _ in results):
+            return list()
+        # slot positions of the components in this table
+        positions = [
+            slots.course_slots(courses) for bucket in buckets for courses in bucket
+        ]
+        count = min(max(len(x) for x, _ in results), self.settings.number_of_solutions)
+        solutions: list[list[int]] = list()
+        for i in range(count):
+            selected: list[int] = list()
+            for (component_sols, _), component_positions in zip(results, positions):
+                local = component_sols[min(i, len(component_sols) - 1)]
+                selected.extend(component_positions[local].tolist())
+            selected.sort()
+            solutions.append(selected)
+            self._report_solution(
+                "solution",
+                selected,
+                index=i,
+                objective=int(slots.prefered[selected].sum()),
+            )
+        return solutions
+
+    def _component(self, courses: np.ndarray) -> tuple[list[SolverCourse], SlotTable]:
+        # the pydantic slots are not needed by the pool process, only the table
+        data = [
+            self.data[i].model_copy(update={"time_slots": []}) for i in courses.tolist()
+        ]
+        return data, self.slots.select_courses(courses)
+
+    def _load_model(self) -> cp_model.CpModel:
+        """Returns the built model from the model cache when the input did not change"""
+        if not model_cache.enabled:
+            return self._build_model()[0]
+        key = model_fingerprint(self.slots, self.professors, self.settings)
+        proto = model_cache.get(key)
+        if proto is not None:
+            model = cp_model.CpModel()
+            model.proto.ParseFromString(proto)
+            logger.info("model %s loaded from the cache", key)
+            return model
+        model = self._build_model()[0]
+        model_cache.put(key, model.proto.SerializeToString())
+        return model
+
+    def _keep_warm_start(self, model: cp_model.CpModel) -> None:
+        """Keeps the unaffected courses in their previous slot through assumptions,
+        so they can be released if the changed courses don't fit around them"""
+        slots = self.slots
+        hinted: list[int] = list()
+        values: list[bool] = list()
+        for index, course_id in enumerate(slots.course_ids.tolist()):
+            previous = self.warm_start.get(course_id)
+            if previous is None:
+                continue
+            day, start_time, end_time, prof = previous
+            course_slots = slice(slots.offsets[index], slots.offsets[index + 1])
+            hinted.extend(range(course_slots.start, course_slots.stop))
+            values.extend(
+                (
+                    (slots.day[course_slots] == day)
+                    & (
+                        slots.start[course_slots]
+                        == convert_time_to_min(int(start_time))
+                    )
+                    & (slots.end[course_slots] == convert_time_to_min(int(end_time)))
+                    & (slots.prof[course_slots] == prof)
+                ).tolist()
+            )
+        _add_hints(model, hinted, values)
+        kept = [i for i, value in zip(hinted, values) if value]
+        model.proto.assumptions.extend(kept)
+        logger.info("incremental solve, %s courses kept in place", len(kept))
+
+    def _search(
+        self,
+        solver: cp_model.CpSolver,
+        model: cp_model.CpModel,
+        callback: cp_model.CpSolverSolutionCallback | None,
+        phase: str,
+    ) -> int:
+        """Runs one cp-sat search and adds its statistics to the search report"""
+        if self.cancelled:
+            # stops right away, the response is still filled for the callers
+            solver.parameters.max_time_in_seconds = 0
+        with self._solver_lock:
+            self._solver = solver
+        try:
+            with span(self.search.spans, phase):
+                stat = solver.solve(model, callback)
+        finally:
+            with self._solver_lock:
+                self._solver = None
+        self.search.branches += solver.num_branches
+        self.search.conflicts += solver.num_conflicts
+        self.search.wall_time += solver.wall_time
+        return stat
+
+    def _solve_model(self) -> list[list[int]]:  # noqa: C901
+        with span(self.search.spans, "model_build"):
+            model = self._load_model()
+        self.search.variables = len(model.proto.variables)
+        self.search.constraints = len(model.proto.constraints)
+        variables = len(self.slots)
+        bool_variables_prefered = [
+            model.get_bool_var_from_proto_index(i)
+            for i in np.flatnonzero(self.slots.prefered).tolist()
+        ]
         # maxumize for prefered time slots, maximize the perefered time by the professors
-        model.maximize(sum(bool_variables_prefered))
-        solver = cp_model.CpSolver()
-        for i in range(self.settings.number_of_solutions):
-            stat = solver.solve(model)
-            if stat == cp_model.INFEASIBLE:
-                logger.info("INFEASIBLE")
-                break
-            if stat == cp_model.MODEL_INVALID:
-                logger.info("MODEL_INVALID")
-            if stat == cp_model.UNKNOWN:
-                logger.info("UNKNOWN")
-                break
-            # if stat in [cp_model.OPTIMAL, cp_model.FEASIBLE]:
-            #     print("optimal,fes")
-            sol_vars = list()
-            # course id, selected time slot, score of this solution
-            last_sol: list[tuple[int, SolverCourseTimeSlot, int]] = list()
-            # append the solution to the list of solutions
-            for (id, solver_timeslot), model_bool_variable in bool_variables.items():  # noqa: A001
-                if solver.value(model_bool_variable):
-                    sol_vars.append(model_bool_variable)
-                    # TODO :Add score to it, 50 is just a placeholder
-                    last_sol.append((id, solver_timeslot, 50))
-            model.add(sum(sol_vars) <= len(sol_vars) - 1)
-            print(solver.user_time)
-            self.soloutins.append(last_sol)
-        return self.soloutins
+        objective = cp_model.LinearExpr.sum(bool_variables_prefered)
+        model.maximize(objective)
+        if self.settings.search_strategy == SolverSearchStrategy.PREFERRED_FIRST:
+            model.add_decision_strategy(
+                bool_variables_prefered,
+                cp_model.CHOOSE_FIRST,
+                cp_model.SELECT_MAX_VALUE,
+            )
+        if self.warm_start:
+            self._keep_warm_start(model)
+        # every course has one slot, so this many prefered slots is the optimum
+        target = len(np.unique(self.slots.course[self.slots.prefered]))
+        greedy = self._greedy_start(model, target)
+        progress = _ProgressCallback(self, variables, target)
+        solver = self._new_search_solver(progress)
+        stat = self._search(solver, model, progress, "search")
+        if self.warm_start and stat in (cp_model.INFEASIBLE, cp_model.UNKNOWN):
+            logger.info("incremental solve failed, solving all the courses")
+            model.clear_assumptions()
+            solver = self._new_search_solver(progress)
+            stat = self._search(solver, model, progress, "search")
+        if stat == cp_model.INFEASIBLE:
+            logger.info("INFEASIBLE")
+            if self.settings.debug:
+                messages = self.diagnose()
+                if messages:
+                    raise ValueError("\n".join(messages))
+            return list()
+        if stat == cp_model.MODEL_INVALID:
+            logger.info("MODEL_INVALID")
+            return list()
+        if stat == cp_model.UNKNOWN:
+            logger.info("UNKNOWN")
+            if greedy is None:
+                return list()
+            # no solution in time, the greedy timetable is still a feasible one
+            objective = int(self.slots.prefered[greedy].sum())
+            self.search.objective = objective
+            # without a solution cp-sat may report no bound (0), only the target is proven
+            bound = solver.best_objective_bound
+            self.search.bound = min(bound, target) if bound >= objective else target
+            self.search.optimal = objective >= target
+            self._report_solution("solution", greedy, index=0, objective=objective)
+            return [greedy]
+        # stopped at the target, it is an optimum even if cp-sat did not prove it
+        optimal = stat == cp_model.OPTIMAL or solver.objective_value >= target
+        self.search.objective = solver.objective_value
+        self.search.bound = (
+            solver.objective_value
+            if optimal
+            else min(solver.best_objective_bound, target)
+        )
+        self.search.optimal = optimal
+        best = _selected_slots(solver.response_proto, variables)
+        collector = _SolutionCollector(
+            self, variables, limit=self.settings.number_of_solutions
+        )
+        collector.add(best)
+        if self.settings.number_of_solutions > 1:
+            self._enumerate(model, objective, best, collector)
+        return [
+            selected for selected, _ in sorted(collector.solutions, key=lambda x: -x[1])
+        ]
+
+    def _greedy_start(self, model: cp_model.CpModel, target: int) -> list[int] | None:
+        """Hints the model with the greedy timetable, returns it if it is a feasible
+        solution (reported as the first incumbent)"""
+        if not self.settings.heuristic:
+            return None
+        slots = self.slots
+        with span(self.search.spans, "heuristic"):
+            greedy, feasible = greedy_assignment(slots, self.professors, self.settings)
+        if not self.warm_start:
+            # the slots of the placed courses, the warm start already hinted its courses
+            placed = np.zeros(slots.course_count, dtype=np.bool_)
+            placed[slots.course[greedy]] = True
+            values = np.zeros(len(slots), dtype=np.bool_)
+            values[greedy] = True
+            hinted = np.flatnonzero(placed[slots.course])
+            _add_hints(model, hinted.tolist(), values[hinted].tolist())
+        if not feasible:
+            return None
+        self._report_solution(
+            "incumbent",
+            greedy,
+            objective=int(slots.prefered[greedy].sum()),
+            bound=target,
+        )
+        return greedy
+
+    def _new_search_solver(self, progress: "_ProgressCallback") -> cp_model.CpSolver:
+        solver = self._new_cp_solver()
+        if self._search_deadline is not None:
+            solver.parameters.max_time_in_seconds = max(
+                0.0, self._search_deadline - monotonic()
+            )
+        if self.reporter is not None:
+            solver.best_bound_callback = progress.on_bound
+        return solver
+
+    def _enumerate(
+        self,
+        model: cp_model.CpModel,
+        objective: cp_model.LinearExpr,
+        best: list[int],
+        collector: "_SolutionCollector",
+    ) -> None:
+        """Collects the rest of the solutions in one enumerating search per objective
+        bound, starting at the optimum and widening the bound only if needed"""
+        best_objective = collector.solutions[0][1]
+        model.clear_objective()
+        model.clear_hints()
+        values = np.zeros(len(self.slots), dtype=np.bool_)
+        values[best] = True
+        _add_hints(model, list(range(len(self.slots))), values.tolist())
+        gap = 0
+        while monotonic() < self._deadline and not self.cancelled:  # type: ignore
+            bound = model.add(objective >= best_objective - gap)
+            solver = self._new_cp_solver(enumerate_all=True)
+            stat = self._search(solver, model, collector, "enumerate")
+            if collector.full or stat not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+                return
+            if best_objective - gap <= 0:
+                # every feasible assignment was enumerated
+                return
+            # all the solutions within the gap are found, allow worse ones
+            bound.proto.Clear()
+            gap = gap * 2 if gap else 1
+
+
+def _group_slots(values: np.ndarray) -> dict[int, list[int]]:
+    """Slot positions grouped by the value of the slot, in slot order"""
+    order = np.argsort(values, kind="stable")
+    keys, starts = np.unique(values[order], return_index=True)
+    return {
+        key: members.tolist()
+        for key, members in zip(keys.tolist(), np.split(order, starts[1:]))
+    }
+
+
+def _add_hints(
+    model: cp_model.CpModel, variables: list[int], values: list[bool]
+) -> None:
+    """Hints the slot variables by index, each variable can only be hinted once"""
+    model.proto.solution_hint.vars.extend(variables)
+    model.proto.solution_hint.values.extend(int(value) for value in values)
+
+
+def _add_interval(
+    proto: cp_model.cp_model_pb2.CpModelProto, literal: int, start: int, size: int
+) -> int:
+    """Adds an optional fixed size interval present when literal is true, returns its index"""
+    constraint = proto.constraints.add()
+    constraint.enforcement_literal.append(literal)
+    constraint.interval.start.offset = start
+    constraint.interval.size.offset = size
+    constraint.interval.end.offset = start + size
+    return len(proto.constraints) - 1
+
+
+def _selected_slots(
+    response: cp_model.cp_model_pb2.CpSolverResponse, count: int
+) -> list[int]:
+    """Positions of the selected slots, the slot variables are the first of the model"""
+    return np.flatnonzero(np.array(response.solution[:count])).tolist()
+
+
+def _solve_bucket(
+    components: list[tuple[list[SolverCourse], SlotTable]],
+    settings: SolverSettings,
+    professors: dict[int, ProfessorRead],
+    deadline: float,
+    warm_start: dict[int, SelectedSlot],
+    cancel: Any = None,
+) -> list[tuple[list[list[int]], SearchReport]]:
+    """Solves the components one after another, runs in a pool process. The time left
+    is shared by the components still to solve in proportion to their slots, so a hard
+    component can't leave nothing for the ones after it"""
+    results = list()
+    sizes = [len(slots) for _, slots in components]
+    for index, (data, slots) in enumerate(components):
+        share = sizes[index] / max(1, sum(sizes[index:]))
+        max_time = max(0.01, (deadline - wall_time()) * share)
+        component_settings = settings.model_copy(
+            update={
+                "max_time_in_seconds": max_time,
+                # in anytime mode every component keeps time for its other solutions
+                "latency_budget_seconds": max_time
+                if settings.latency_budget_seconds is not None
+                else None,
+            }
+        )
+        model_solver = ModelSolver(
+            data=data,
+            settings=component_settings,
+            professors=professors,
+            warm_start=warm_start,
+            slots=slots,
+            cancel=cancel,
+        )
+        solutions = model_solver.solve_slots()
+        if not solutions:
+            solutions = _greedy_fallback(model_solver)
+        results.append((solutions, model_solver.search))
+    return results
+
+
+def _greedy_fallback(model_solver: ModelSolver) -> list[list[int]]:
+    """The greedy timetable of a component the search found nothing for in its time,
+    one unsolved component would leave the whole catalog without a solution"""
+    slots = model_solver.slots
+    greedy, feasible = greedy_assignment(
+        slots, model_solver.professors, model_solver.settings
+    )
+    if not feasible:
+        return list()
+    search = model_solver.search
+    search.objective = int(slots.prefered[greedy].sum())
+    # every course has one slot, so the courses with a prefered slot bound the objective
+    search.bound = len(np.unique(slots.course[slots.prefered]))
+    search.optimal = search.objective >= search.bound
+    return [greedy]
+
+
+class _ProgressCallback(cp_model.CpSolverSolutionCallback):
+    """Reports the incumbents and the objective bound of the optimization search,
+    the first incumbent right away and then at most one event per interval.
+    Stops the search once the objective reaches the target"""
+
+    def __init__(
+        self,
+        model_solver: ModelSolver,
+        variables: int,
+        target: float,
+        interval: float = 1.0,
+    ) -> None:
+        super().__init__()
+        self.model_solver = model_solver
+        self.variables = variables
+        self.target = target
+        self.interval = interval
+        self._objective: float | None = None
+        self._last_incumbent: float | None = None
+        self._last_progress = 0.0
+
+    def on_solution_callback(self) -> None:
+        self._objective = self.objective_value
+        if self.objective_value >= self.target:
+            self.stop_search()
+        if self.model_solver.reporter is None:
+            return
+        now = monotonic()
+        if (
+            self._last_incumbent is not None
+            and now - self._last_incumbent < self.interval
+        ):
+            return
+        self._last_incumbent = now
+        self.model_solver._report_solution(
+            "incumbent",
+            _selected_slots(self.response_proto, self.variables),
+            objective=self.objective_value,
+            bound=self.best_objective_bound,
+        )
+
+    def on_bound(self, bound: float) -> None:
+        now = monotonic()
+        if now - self._last_progress < self.interval:
+            return
+        self._last_progress = now
+        self.model_solver.reporter(  # type: ignore
+            {"type": "progress", "objective": self._objective, "bound": bound}
+        )
+
+
+class _SolutionCollector(cp_model.CpSolverSolutionCallback):
+    """Keeps the distinct solutions found during a search, stops it at the limit"""
+
+    def __init__(
+        self,
+        model_solver: ModelSolver,
+        variables: int,
+        limit: int,
+    ) -> None:
+        super().__init__()
+        self.model_solver = model_solver
+        self.variables = variables
+        self.limit = limit
+        # selected slot positions and objective of each solution
+        self.solutions: list[tuple[list[int], int]] = []
+        self._seen: set[tuple[int, ...]] = set()
+
+    @property
+    def full(self) -> bool:
+        return len(self.solutions) >= self.limit
+
+    def add(self, selected: list[int]) -> None:
+        signature = tuple(selected)
+        if self.full or signature in self._seen:
+            return
+        self._seen.add(signature)
+        # the number of selected prefered slots
+        objective = int(self.model_solver.slots.prefered[selected].sum())
+        self.solutions.append((selected, objective))
+        self.model_solver._report_solution(
+            "solution", selected, index=len(self.solutions) - 1, objective=objective
+        )
+
+    def on_solution_callback(self) -> None:
+        self.add(_selected_slots(self.response_proto, self.variables))
+        if self.full:
+            self.stop_search()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,654 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Any
+
+from sqlmodel import Session
+
+from app.core import metrics
+from app.core.config import settings as app_settings
+from app.core.metrics import Spans, registry, span
+from app.crud.solver import create_solver_resualt, get_solver_resualt
+from app.db.session import engine
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import Courses as SolverCourse
+from app.schemas.solver import (
+    SolverHistoryResualtCreate,
+    SolverJobRead,
+    SolverJobStatus,
+    SolverPhaseTiming,
+    SolverSettings,
+    SolverSolution,
+    SolverSolutionScore,
+)
+from app.solver.incremental import SelectedSlot
+from app.solver.slots import SlotTable, VariableKey
+from app.solver.solver import SearchReport
+from app.tasks.worker import run_solve
+from app.utils.history import read_solutions
+from app.utils.parser import SolverOutputBuilder
+from app.utils.system import available_cpus
+
+logger = logging.getLogger()
+
+# retry hint of a full queue until a job has finished
+DEFAULT_JOB_SECONDS = 30
+
+
+class SolverQueueFullError(Exception):
+    """The solver queue has no room for another job, retry_after is the estimated
+    number of seconds until it has"""
+
+    def __init__(self, retry_after: int) -> None:
+        super().__init__(f"Too many solves are waiting, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+@dataclass
+class SolverJob:
+    id: str
+    settings: SolverSettings
+    data: list[SolverCourse]
+    professors: dict[int, ProfessorRead]
+    input_fingerprints: dict | None = None
+    status: SolverJobStatus = SolverJobStatus.QUEUED
+    solutions_found: int = 0
+    error: str | None = None
+    # the error is caused by the input data (bad request) and not by the server
+    input_error: bool = False
+    solver_resualt_id: int | None = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    # objective and bound of the best solution found so far
+    objective: float | None = None
+    bound: float | None = None
+    gap: float | None = None
+    optimal: bool | None = None  # set when the job finished
+    done: threading.Event = field(default_factory=threading.Event)
+    # server sent events of the job, replayed to the clients that subscribe late. A
+    # solution event is kept as (type, data, (keys, score)) until a client reads it
+    events: list[str | tuple[str, dict, tuple]] = field(default_factory=list)
+    subscribers: list[tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = field(
+        default_factory=list
+    )
+    events_closed: bool = False
+    # reentrant, the solutions are built with it held
+    events_lock: threading.RLock = field(default_factory=threading.RLock)
+    # futures of the requests awaiting the job, resolved when it is done
+    done_futures: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = field(
+        default_factory=list
+    )
+    output: SolverOutputBuilder | None = None
+    spans: Spans = field(default_factory=list)
+    # manager event the pool process polls, set to stop the search
+    cancel_event: Any = None
+    cancel_requested: bool = False
+    # the pool process returned, only saving the solutions is left
+    solved: bool = False
+    # keep the solutions found before the cancellation as a history row
+    persist_cancelled: bool = False
+    # clients waiting for the job (/solve, /solve/stream), the job is cancelled when the
+    # last one disconnects unless it was also submitted as a background job (detached)
+    waiters: int = 0
+    detached: bool = False
+
+    def publish(
+        self,
+        event_type: str,
+        data: dict,
+        close: bool = False,
+        solution: tuple[list[VariableKey], SolverSolutionScore] | None = None,
+    ) -> None:
+        """Sends an event to the subscribers, close ends their streams after it. The
+        solution is added to data as a SolverSolution, only built once a client reads
+        the event"""
+        with self.events_lock:
+            if self.events_closed:
+                return
+            event = (
+                (event_type, data, solution)
+                if solution is not None
+                else _format_event(event_type, data)
+            )
+            if close:
+                # the solutions are in the history row now, only the last event is replayed
+                self.events = [event]
+                self.events_closed = True
+            else:
+                self.events.append(event)
+            if not self.subscribers:
+                return
+            message = self._message(len(self.events) - 1)
+            for loop, queue in self.subscribers:
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, message)
+                    if close:
+                        loop.call_soon_threadsafe(queue.put_nowait, None)
+                except RuntimeError:  # the loop of the client is closed
+                    continue
+            if close:
+                self.subscribers.clear()
+
+    def subscribe(
+        self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue
+    ) -> tuple[list[str], bool]:
+        """Returns the events published so far and if the stream is already closed"""
+        with self.events_lock:
+            if not self.events_closed:
+                self.subscribers.append((loop, queue))
+            history = [self._message(i) for i in range(len(self.events))]
+            return history, self.events_closed
+
+    def _message(self, index: int) -> str:
+        """The server sent event of events[index], building its solution on first use"""
+        event = self.events[index]
+        if isinstance(event, str):
+            return event
+        event_type, data, (keys, score) = event
+        solution = self.output_builder().solution(keys, score)
+        message = _format_event(
+            event_type, {**data, "solution": solution.model_dump(mode="json")}
+        )
+        self.events[index] = message
+        return message
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        with self.events_lock:
+            self.subscribers = [x for x in self.subscribers if x[1] is not queue]
+
+    async def wait(self, timeout: float) -> bool:
+        """Waits for the job without holding a thread, False if it is still not done
+        after timeout seconds"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.events_lock:
+            if self.done.is_set():
+                return True
+            self.done_futures.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self.events_lock:
+                self.done_futures = [x for x in self.done_futures if x[1] is not future]
+
+    def output_builder(self) -> SolverOutputBuilder:
+        """Builds the solutions of the job, created on first use"""
+        with self.events_lock:
+            if self.output is None:
+                self.output = SolverOutputBuilder(self.data, self.professors)
+            return self.output
+
+    def to_read(self) -> SolverJobRead:
+        return SolverJobRead(
+            job_id=self.id,
+            name=self.settings.solver_resualt_name,
+            status=self.status,
+            solutions_found=self.solutions_found,
+            number_of_solutions=self.settings.number_of_solutions,
+            error=self.error,
+            solver_resualt_id=self.solver_resualt_id,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            objective=self.objective,
+            bound=self.bound,
+            gap=self.gap,
+            optimal=self.optimal,
+            queue_position=queue_position(self),
+            timings=[
+                SolverPhaseTiming(phase=phase, seconds=round(seconds, 4))
+                for phase, seconds in self.spans
+            ],
+        )
+
+
+_lock = threading.Lock()
+_jobs: "OrderedDict[str, SolverJob]" = OrderedDict()
+_executor: ProcessPoolExecutor | None = None
+# parsing and saving the solutions is done here, so the pool management thread is never blocked
+_finisher: ThreadPoolExecutor | None = None
+_manager: Any = None
+_events: Any = None
+_pump: threading.Thread | None = None
+# jobs waiting for a pool process: (not interactive, slots, order, job, run_solve arguments),
+# the interactive and smaller solves go first
+_queue: list[tuple[bool, int, int, "SolverJob", tuple]] = []
+_order = itertools.count()
+_running = 0
+# moving average of the time a job holds a pool process
+_job_seconds: float | None = None
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    # spawn so the pool processes do not inherit the server threads and db connections
+    return ProcessPoolExecutor(
+        max_workers=app_settings.solver_pool_size,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def _start() -> ProcessPoolExecutor:
+    global _executor, _finisher, _manager, _events, _pump
+    if _executor is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+        _events = _manager.Queue()
+        _executor = _new_executor()
+        _finisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="solver-jobs")
+        _pump = threading.Thread(target=_pump_events, args=(_events,), daemon=True)
+        _pump.start()
+    return _executor
+
+
+def _pump_events(events: Any) -> None:
+    """Applies the progress events sent by the pool processes to the jobs."""
+    while True:
+        try:
+            event = events.get()
+        except (EOFError, OSError):
+            return
+        if event is None:
+            return
+        job = get_job(event["job_id"])
+        if job is None:
+            continue
+        try:
+            _apply_event(job, event)
+        except Exception:
+            logger.exception("could not apply the event of solver job %s", job.id)
+
+
+def _apply_event(job: SolverJob, event: dict) -> None:
+    event_type = event["type"]
+    payload = {
+        key: value
+        for key, value in event.items()
+        if key not in ("job_id", "type", "solution")
+    }
+    if event_type == "started":
+        job.status = SolverJobStatus.RUNNING
+        job.started_at = datetime.now(timezone.utc)
+    elif event_type == "solution":
+        job.solutions_found = max(job.solutions_found, event["index"] + 1)
+    if event_type in ("progress", "incumbent"):
+        job.objective = event["objective"]
+        job.bound = event["bound"]
+    solution = None
+    if event_type in ("solution", "incumbent"):
+        if job.done.is_set():
+            return
+        solution = (event["solution"], SolverSolutionScore(**event["score"]))
+    job.publish(event_type, payload, solution=solution)
+
+
+def _format_event(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+def stored_solution_events(job: SolverJob) -> list[str]:
+    """The solution events of a job whose events are closed, read back from its history
+    row, for the clients that subscribe after it finished (a cached job for example)"""
+    if job.solver_resualt_id is None:
+        return []
+    with Session(engine) as session:
+        solver_resualt = get_solver_resualt(session, job.solver_resualt_id)
+        solutions = read_solutions(solver_resualt) if solver_resualt else []
+    return [
+        _format_event(
+            "solution",
+            {
+                "index": index,
+                "objective": sum(
+                    course["selected_slot"]["prefered"]
+                    for course in solution["courses"]
+                ),
+                "score": solution.get("score"),
+                "solution": solution,
+            },
+        )
+        for index, solution in enumerate(solutions)
+    ]
+
+
+def _forget_old_jobs() -> None:
+    finished = [job_id for job_id, job in _jobs.items() if job.done.is_set()]
+    for job_id in finished[: max(0, len(finished) - app_settings.solver_job_history)]:
+        del _jobs[job_id]
+
+
+def workers_per_solve() -> int:
+    """cp-sat workers of every running solve, the worker budget divided by the pool size"""
+    budget = app_settings.solver_worker_budget or available_cpus()
+    return max(1, budget // app_settings.solver_pool_size)
+
+
+def _retry_after() -> int:
+    seconds = _job_seconds if _job_seconds is not None else DEFAULT_JOB_SECONDS
+    return max(
+        1, math.ceil(seconds * (len(_queue) + 1) / app_settings.solver_pool_size)
+    )
+
+
+def queue_stats() -> dict[str, int]:
+    with _lock:
+        return {
+            "running": _running,
+            "queued": len(_queue),
+            "pool_size": app_settings.solver_pool_size,
+            "queue_size": app_settings.solver_queue_size,
+            "workers_per_solve": workers_per_solve(),
+        }
+
+
+def queue_position(job: SolverJob) -> int | None:
+    """1 for the next job to start, None if the job is not waiting"""
+    with _lock:
+        for entry in _queue:
+            if entry[3] is job:
+                return sum(1 for x in _queue if x[:3] < entry[:3]) + 1
+    return None
+
+
+def _replace_broken_executor(broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    """A pool process died (killed by the oom killer for example), which breaks the
+    whole pool, its running jobs fail and the next ones get a new pool"""
+    global _executor
+    with _lock:
+        if _executor is broken:
+            logger.error("a solver process died, restarting the solver pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = _new_executor()
+        return _executor  # type: ignore
+
+
+def _dispatch() -> None:
+    """Starts the waiting jobs with the highest priority while the pool has room"""
+    global _running
+    executor = _start()
+    while True:
+        with _lock:
+            if _running >= app_settings.solver_pool_size or not _queue:
+                return
+            *_, job, arguments = heapq.heappop(_queue)
+            _running += 1
+        data, slots, settings, professors, warm_start = arguments
+        # the worker budget is shared by the pool, a solve never takes all the cpus
+        workers = workers_per_solve()
+        settings = settings.model_copy(
+            update={"num_workers": min(settings.num_workers or workers, workers)}
+        )
+        arguments = (
+            job.id,
+            data,
+            slots,
+            settings,
+            professors,
+            _events,
+            warm_start,
+            job.cancel_event,
+            job.created_at.timestamp(),
+        )
+        started = monotonic()
+        try:
+            try:
+                future = executor.submit(run_solve, *arguments)
+            except BrokenProcessPool:
+                executor = _replace_broken_executor(executor)
+                future = executor.submit(run_solve, *arguments)
+        except Exception as ex:
+            logger.exception("could not start solver job %s", job.id)
+            with _lock:
+                _running -= 1
+            job.error = str(ex)
+            job.status = SolverJobStatus.FAILED
+            _close_job(job, None)
+            continue
+        future.add_done_callback(
+            lambda f, job=job, started=started: _job_done(job, f, started)
+        )
+
+
+def _job_done(job: SolverJob, future: Future, started: float) -> None:
+    global _running, _job_seconds
+    seconds = monotonic() - started
+    with _lock:
+        _running -= 1
+        job.solved = True
+        _job_seconds = (
+            seconds if _job_seconds is None else 0.8 * _job_seconds + 0.2 * seconds
+        )
+    finisher = _finisher
+    if finisher is None:
+        return
+    try:
+        # the next job is started first, parsing and saving this one can take a while
+        finisher.submit(_dispatch)
+        finisher.submit(_finish_job, job, future)
+    except RuntimeError:  # the server is shutting down
+        return
+
+
+def submit_solve_job(
+    data: list[SolverCourse],
+    slots: SlotTable,
+    settings: SolverSettings,
+    professors: dict[int, ProfessorRead],
+    input_fingerprints: dict | None = None,
+    warm_start: dict[int, SelectedSlot] | None = None,
+    spans: Spans | None = None,
+    interactive: bool = False,
+) -> SolverJob:
+    """Queues a solve and returns right away, spans are the phases of the request that
+    ran before it. Interactive (a client waits for it) and smaller solves start first,
+    SolverQueueFullError is raised when the queue is full"""
+    _start()
+    job = SolverJob(
+        id=uuid.uuid4().hex,
+        settings=settings,
+        data=data,
+        professors=professors,
+        input_fingerprints=input_fingerprints,
+        spans=list(spans or []),
+        cancel_event=_manager.Event(),
+    )
+    with _lock:
+        if len(_queue) >= app_settings.solver_queue_size:
+            raise SolverQueueFullError(_retry_after())
+        _forget_old_jobs()
+        _jobs[job.id] = job
+        heapq.heappush(
+            _queue,
+            (
+                not interactive,
+                len(slots),
+                next(_order),
+                job,
+                (data, slots, settings, professors, warm_start),
+            ),
+        )
+    job.publish("queued", job.to_read().model_dump(mode="json"))
+    _dispatch()
+    return job
+
+
+def cancel_job(job: SolverJob, persist: bool = False) -> bool:
+    """Stops a queued or running job, with persist the solutions found until then are
+    saved as a history row. Returns False if the search already ended"""
+    with _lock:
+        if job.solved or job.done.is_set():
+            return False
+        job.cancel_requested = True
+        job.persist_cancelled = job.persist_cancelled or persist
+        queued = [entry for entry in _queue if entry[3] is job]
+        for entry in queued:
+            _queue.remove(entry)
+        heapq.heapify(_queue)
+        cancel_event = job.cancel_event
+    if queued:
+        job.status = SolverJobStatus.CANCELLED
+        _close_job(job, None)
+    elif cancel_event is not None:
+        # the pool process stops the search within CANCEL_POLL_SECONDS
+        cancel_event.set()
+    return True
+
+
+def hold_job(job: SolverJob) -> None:
+    """A client waits for the job"""
+    with _lock:
+        job.waiters += 1
+
+
+def release_job(job: SolverJob) -> None:
+    """The client is done with the job, a job nobody waits for anymore is cancelled"""
+    with _lock:
+        job.waiters -= 1
+        abandoned = job.waiters == 0 and not job.detached
+    if abandoned and not job.done.is_set():
+        logger.info("solver job %s was abandoned by its clients", job.id)
+        cancel_job(job)
+
+
+def get_job(job_id: str) -> SolverJob | None:
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> list[SolverJob]:
+    with _lock:
+        return list(reversed(_jobs.values()))
+
+
+def _record_metrics(job: SolverJob, search: SearchReport | None) -> None:
+    metrics.SOLVER_JOBS.inc(status=job.status.value)
+    for phase, seconds in job.spans:
+        metrics.SOLVER_PHASE_SECONDS.observe(seconds, phase=phase)
+    if search is None:
+        return
+    metrics.SOLVER_SEARCH_SECONDS.observe(search.wall_time)
+    metrics.SOLVER_BRANCHES.inc(search.branches)
+    metrics.SOLVER_CONFLICTS.inc(search.conflicts)
+    metrics.SOLVER_OBJECTIVE.set(search.objective)
+    metrics.SOLVER_BOUND.set(search.bound)
+    metrics.SOLVER_GAP.set(search.gap)
+    metrics.SOLVER_MODEL_SIZE.set(len(job.data), kind="courses")
+    metrics.SOLVER_MODEL_SIZE.set(search.variables, kind="variables")
+    metrics.SOLVER_MODEL_SIZE.set(search.constraints, kind="constraints")
+
+
+def _finish_job(job: SolverJob, future: Future) -> None:
+    search: SearchReport | None = None
+    try:
+        data: list[tuple[list[VariableKey], SolverSolutionScore]]
+        data, search = future.result()
+        job.spans.extend(search.spans)
+        found = len(data) > 0 and len(data[0][0]) > 0
+        if job.cancel_requested and not (found and job.persist_cancelled):
+            job.status = SolverJobStatus.CANCELLED
+            return
+        if not found:
+            raise ValueError("جوابی پیدا نشد")
+        with span(job.spans, "parse"):
+            builder = job.output_builder()
+            output_sols: list[SolverSolution] = [
+                builder.solution(sol, score) for sol, score in data
+            ]
+        with span(job.spans, "persist"), Session(engine) as session:
+            solver_resualt = create_solver_resualt(
+                session=session,
+                solver_resualt_data=SolverHistoryResualtCreate(
+                    name=job.settings.solver_resualt_name,
+                    resualt=output_sols,
+                ),
+                input_fingerprints=job.input_fingerprints,
+            )
+        job.solver_resualt_id = solver_resualt.id
+        job.solutions_found = len(data)
+        job.objective = search.objective
+        job.bound = search.bound
+        job.gap = search.gap
+        job.optimal = search.optimal
+        job.status = (
+            SolverJobStatus.CANCELLED
+            if job.cancel_requested
+            else SolverJobStatus.FINISHED
+        )
+    except ValueError as ex:
+        job.error = str(ex)
+        job.input_error = True
+        job.status = SolverJobStatus.FAILED
+    except BrokenProcessPool:
+        logger.error("the process of solver job %s died", job.id)
+        job.error = "The solver process died, it may have run out of memory"
+        job.status = SolverJobStatus.FAILED
+    except Exception as ex:
+        logger.exception("solver job %s failed", job.id)
+        job.error = str(ex)
+        job.status = SolverJobStatus.FAILED
+    finally:
+        _close_job(job, search)
+
+
+def _close_job(job: SolverJob, search: SearchReport | None) -> None:
+    job.finished_at = datetime.now(timezone.utc)
+    logger.info("solver job %s %s: %s", job.id, job.status.value, job.spans)
+    _record_metrics(job, search)
+    job.cancel_event = None
+    with job.events_lock:
+        job.done.set()
+        futures, job.done_futures = job.done_futures, []
+    for loop, future in futures:
+        try:
+            loop.call_soon_threadsafe(_resolve, future)
+        except RuntimeError:  # the loop of the request is closed
+            continue
+    job.publish(job.status.value, job.to_read().model_dump(mode="json"), close=True)
+    # the input is only needed while the job runs and its events are not closed
+    job.data = []
+    job.professors = {}
+    job.output = None
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def shutdown_jobs() -> None:
+    global _executor, _finisher, _manager, _events, _pump, _running
+    if _executor is None:
+        return
+    with _lock:
+        _queue.clear()
+        _running = 0
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _finisher.shutdown(wait=False)  # type: ignore
+    _events.put(None)
+    _pump.join(timeout=5)  # type: ignore
+    _manager.shutdown()
+    _executor = _finisher = _manager = _events = _pump = None
+
+
+registry.gauge(
+    "solver_queue_depth",
+    "Solver jobs waiting for a process",
+    function=lambda: len(_queue),
+)
+registry.gauge(
+    "solver_running_jobs", "Solver jobs holding a process", function=lambda: _running
+)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from app.core.config import settings as app_settings
+from app.core.metrics import registry
+from app.schemas.solver import SolverJobStatus, SolverSettings
+
+if TYPE_CHECKING:
+    from app.tasks.jobs import SolverJob
+
+
+def result_key(input_fingerprints: dict, settings: SolverSettings) -> str:
+    """Hash of the solver input and the settings, the name of the result is left out"""
+    payload = json.dumps(
+        [
+            input_fingerprints,
+            settings.model_dump(mode="json", exclude={"solver_resualt_name"}),
+        ],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """LRU of the solver jobs by the result key of their request. Identical requests
+    that come while a job is queued or running share it instead of starting their own,
+    the later ones get the finished job and its history row. Failed and cancelled jobs
+    are never shared.
+
+    The key only covers what the model depends on, the titles and names of the output
+    are not part of it, so every write to the courses, professors, classrooms and
+    majors clears the cache."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        # changes on every invalidation, a job of an older generation is never cached
+        self.generation = 0
+        self._jobs: OrderedDict[str, "SolverJob"] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get_or_submit(
+        self, key: str, generation: int, submit: Callable[[], "SolverJob"]
+    ) -> "SolverJob":
+        """Returns the job of key or the one submit queues, generation is the one read
+        before the input was fetched from the db"""
+        if not self.enabled:
+            return submit()
+        with self._lock:
+            job = self._jobs.get(key)
+            if (
+                job is not None
+                and not job.cancel_requested
+                and job.status != SolverJobStatus.FAILED
+            ):
+                self._jobs.move_to_end(key)
+                if job.done.is_set():
+                    self.hits += 1
+                else:
+                    self.coalesced += 1
+                return job
+            self.misses += 1
+            # submit only queues the job, the lock makes the identical requests wait for it
+            job = submit()
+            if generation == self.generation:
+                self._jobs[key] = job
+                while len(self._jobs) > self.max_entries:
+                    self._jobs.popitem(last=False)
+            return job
+
+    def invalidate(self) -> None:
+        """Drops every job, called when the input of the solver changes"""
+        with self._lock:
+            self.generation += 1
+            self._jobs.clear()
+
+    def discard_resualt(self, solver_resualt_id: int) -> None:
+        """Drops the jobs whose history row is deleted"""
+        with self._lock:
+            for key in [
+                key
+                for key, job in self._jobs.items()
+                if job.solver_resualt_id == solver_resualt_id
+            ]:
+                del self._jobs[key]
+
+
+result_cache = ResultCache(app_settings.solver_result_cache_size)
+
+registry.counter(
+    "solver_result_cache_hits_total",
+    "Solve requests answered by a finished job",
+    function=lambda: result_cache.hits,
+)
+registry.counter(
+    "solver_result_cache_coalesced_total",
+    "Solve requests that waited for an identical running job",
+    function=lambda: result_cache.coalesced,
+)
+registry.counter(
+    "solver_result_cache_misses_total",
+    "Solve requests that started a job",
+    function=lambda: result_cache.misses,
+)
@@ -0,0 +1,77 @@
+import logging
+from time import time
+from typing import Any
+
+from app.core.metrics import Spans, span
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import Courses as SolverCourse
+from app.schemas.solver import SolverSettings, SolverSolutionScore
+from app.solver.incremental import SelectedSlot
+from app.solver.presolve import presolve
+from app.solver.scoring import score_solutions
+from app.solver.slots import SlotTable, VariableKey
+from app.solver.solver import ModelSolver, SearchReport
+
+logger = logging.getLogger()
+
+# This module is imported by the pool processes, keep it free of db/fastapi imports
+
+
+def run_solve(
+    job_id: str,
+    data: list[SolverCourse],
+    slots: SlotTable,
+    settings: SolverSettings,
+    professors: dict[int, ProfessorRead],
+    events: Any = None,
+    warm_start: dict[int, SelectedSlot] | None = None,
+    cancel: Any = None,
+    submitted: float | None = None,
+) -> tuple[list[tuple[list[VariableKey], SolverSolutionScore]], SearchReport]:
+    """Runs ModelSolver inside a pool process, progress is sent to the events queue.
+    Returns the selected slots and the score of every solution (the parent builds the
+    output from them) and the outcome of the search with its statistics and spans.
+    Once the cancel event is set the search stops and the solutions found so far
+    are returned. submitted is the wall clock time the job was queued, the latency
+    budget counts from it."""
+    started = submitted if submitted is not None else time()
+    if cancel is not None and cancel.is_set():
+        # cancelled while it was handed to the process
+        return [], SearchReport()
+
+    def report(event: dict) -> None:
+        if events is not None:
+            events.put({"job_id": job_id, **event})
+
+    report({"type": "started"})
+    presolve_spans: Spans = []
+    with span(presolve_spans, "presolve"):
+        slots, presolve_report = presolve(slots, professors, settings)
+    logger.info("presolve: %s", presolve_report)
+    report({"type": "presolve", **presolve_report.asdict()})
+    if settings.latency_budget_seconds is not None:
+        # the wait in the queue, the start of the process and presolve are included
+        settings = settings.model_copy(
+            update={
+                "latency_budget_seconds": max(
+                    0.01, settings.latency_budget_seconds - (time() - started)
+                )
+            }
+        )
+    model = ModelSolver(
+        data=data,
+        settings=settings,
+        professors=professors,
+        reporter=report,
+        warm_start=warm_start,
+        slots=slots,
+        cancel=cancel,
+    )
+    solutions = model.solve_slots()
+    model.search.spans[:0] = presolve_spans
+    with span(model.search.spans, "scoring"):
+        scores = score_solutions(slots, solutions, professors)
+    return [
+        ([slots.key(i) for i in selected], score)
+        for selected, score in zip(solutions, scores)
+    ], model.search
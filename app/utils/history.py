@@ -0,0 +1,288 @@
+import json
+import zlib
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from app.core.config import settings as app_settings
+from app.models.solver import SolverResualt
+from app.schemas.solver import SolverSolution
+
+# fields of the selected slot, in the order of the rows of the snapshot slot table
+SLOT_FIELDS = (
+    "day",
+    "start_time",
+    "end_time",
+    "professor_id",
+    "professor_name",
+    "prefered",
+)
+
+
+# course fields that read_solution can filter by, besides the professor of the selected slot
+INDEX_FIELDS = ("group_id", "major_id", "classroom_id")
+
+
+def _compress(data: bytes) -> bytes:
+    return zlib.compress(data, app_settings.solver_history_compression_level)
+
+
+def _solution_courses(solution: Any) -> Iterator[tuple[int, Any, tuple]]:
+    """(course id, course, selected slot row) of every course of a solution, the solver
+    output is read from the models and the results posted by hand from their json"""
+    if isinstance(solution, SolverSolution):
+        for course in solution.courses:
+            slot = course.selected_slot
+            yield course.id, course, tuple(getattr(slot, x) for x in SLOT_FIELDS)
+    else:
+        for course in solution["courses"]:
+            slot = course["selected_slot"]
+            yield course["id"], course, tuple(slot[x] for x in SLOT_FIELDS)
+
+
+def _course_payload(course: Any) -> dict:
+    if isinstance(course, dict):
+        return {k: v for k, v in course.items() if k != "selected_slot"}
+    return course.model_dump(mode="json", exclude={"selected_slot"})
+
+
+def _course_index(courses: list[dict], slots: dict[tuple, int]) -> dict[str, Any]:
+    """Positions of the courses of every group, major and classroom, the course ids and
+    the professor of every selected slot"""
+    course_index: dict[str, Any] = {field: {} for field in INDEX_FIELDS}
+    for position, course in enumerate(courses):
+        for field in INDEX_FIELDS:
+            if course.get(field) is not None:
+                course_index[field].setdefault(str(course[field]), []).append(position)
+    course_index["course_ids"] = [course["id"] for course in courses]
+    course_index["slot_professors"] = [slot[3] for slot in slots]
+    return course_index
+
+
+def solution_scores(solutions: list) -> list | None:
+    """Scores of the solutions, stored next to the packed columns"""
+    scores: list = []
+    for solution in solutions:
+        if isinstance(solution, SolverSolution):
+            scores.append(solution.score.model_dump() if solution.score else None)
+        else:
+            scores.append(solution.get("score") if isinstance(solution, dict) else None)
+    return scores if any(scores) else None
+
+
+def pack_solutions(solutions: list) -> tuple[bytes, bytes, bytes] | None:
+    """Splits the solutions into the input snapshot (every course and every distinct
+    selected slot once), the assignment matrix (row k holds the slot index of each course
+    in solution k) and the course index used by read_solution. Returns None if the
+    solutions don't share the same courses in the same order, those are stored as they are"""
+    course_ids: list[int] = []
+    courses: list[dict] = []
+    slots: dict[tuple, int] = {}
+    assignments: list[list[int]] = []
+    try:
+        for solution in solutions:
+            row: list[int] = []
+            for position, (course_id, course, slot) in enumerate(
+                _solution_courses(solution)
+            ):
+                if not assignments:
+                    course_ids.append(course_id)
+                    courses.append(_course_payload(course))
+                elif position >= len(course_ids) or course_ids[position] != course_id:
+                    return None
+                row.append(slots.setdefault(slot, len(slots)))
+            if len(row) != len(course_ids):
+                return None
+            assignments.append(row)
+    except (KeyError, TypeError, AttributeError):
+        return None
+    if not course_ids:
+        return None
+    # the slots on the first line and one course per line, so a part of the courses
+    # can be read without parsing the rest
+    snapshot = "\n".join(
+        json.dumps(x, separators=(",", ":")) for x in [list(slots), *courses]
+    )
+    return (
+        _compress(snapshot.encode()),
+        _compress(np.array(assignments, dtype=np.int32).tobytes()),
+        _compress(
+            json.dumps(_course_index(courses, slots), separators=(",", ":")).encode()
+        ),
+    )
+
+
+def _unpack(
+    snapshot: bytes, assignments: bytes
+) -> tuple[list[dict], list[bytes], np.ndarray]:
+    """The selected slots, the undecoded course lines and the assignment matrix"""
+    lines = zlib.decompress(snapshot).split(b"\n")
+    slots = [dict(zip(SLOT_FIELDS, slot)) for slot in json.loads(lines[0])]
+    matrix = np.frombuffer(zlib.decompress(assignments), dtype=np.int32).reshape(
+        -1, len(lines) - 1
+    )
+    return slots, lines[1:], matrix
+
+
+def unpack_solutions(
+    snapshot: bytes, assignments: bytes, start: int = 0, stop: int | None = None
+) -> list[dict]:
+    """Rebuilds the json of the solutions start:stop from the packed columns"""
+    slots, lines, matrix = _unpack(snapshot, assignments)
+    courses: list[dict] = [json.loads(line) for line in lines]
+    return [
+        {
+            "courses": [
+                {**course, "selected_slot": slots[slot]}
+                for course, slot in zip(courses, row)
+            ]
+        }
+        for row in matrix[start:stop].tolist()
+    ]
+
+
+def read_solutions(
+    solver_resualt: SolverResualt, start: int = 0, stop: int | None = None
+) -> list:
+    """Solutions start:stop of a stored result, in the SolverHistoryResualtRead shape"""
+    if solver_resualt.snapshot is None or solver_resualt.assignments is None:
+        return (solver_resualt.resualt or [])[start:stop]
+    solutions = unpack_solutions(
+        solver_resualt.snapshot, solver_resualt.assignments, start, stop
+    )
+    if solver_resualt.scores:
+        for solution, score in zip(solutions, solver_resualt.scores[start:stop]):
+            solution["score"] = score
+    return solutions
+
+
+def _matches(course: dict, filters: dict[str, int]) -> bool:
+    return all(
+        course["selected_slot"]["professor_id"] == value
+        if field == "professor_id"
+        else course.get(field) == value
+        for field, value in filters.items()
+    )
+
+
+def read_solution(
+    solver_resualt: SolverResualt, index: int, filters: dict[str, int]
+) -> dict | None:
+    """Solution index of a stored result with only the courses that match the filters
+    (group_id, major_id, classroom_id, professor_id), None if there is no such solution.
+    The courses are found with the course index, only they are decoded"""
+    if solver_resualt.course_index is None:
+        solutions = read_solutions(solver_resualt, index, index + 1)
+        if index < 0 or not solutions:
+            return None
+        return {
+            "courses": [x for x in solutions[0]["courses"] if _matches(x, filters)],
+            "score": solutions[0].get("score"),
+        }
+    slots, lines, matrix = _unpack(solver_resualt.snapshot, solver_resualt.assignments)  # type: ignore
+    if not 0 <= index < len(matrix):
+        return None
+    row = matrix[index]
+    keep = np.ones(len(row), dtype=np.bool_)
+    course_index = json.loads(zlib.decompress(solver_resualt.course_index))
+    for field, value in filters.items():
+        if field == "professor_id":
+            keep &= np.array(course_index["slot_professors"])[row] == value
+        else:
+            mask = np.zeros(len(row), dtype=np.bool_)
+            mask[course_index[field].get(str(value), [])] = True
+            keep &= mask
+    return {
+        "courses": [
+            {**json.loads(lines[position]), "selected_slot": slots[row[position]]}
+            for position in np.flatnonzero(keep).tolist()
+        ],
+        "score": solver_resualt.scores[index] if solver_resualt.scores else None,
+    }
+
+
+@dataclass
+class _StoredSolution:
+    course_ids: list[int]
+    selected: list[dict]  # selected slot of the course at each position
+    course: Callable[[int], dict]  # payload of the course at a position
+
+
+def _stored_solution(
+    solver_resualt: SolverResualt, index: int
+) -> _StoredSolution | None:
+    if solver_resualt.course_index is None:
+        solutions = read_solutions(solver_resualt, index, index + 1)
+        if index < 0 or not solutions:
+            return None
+        courses = solutions[0]["courses"]
+        return _StoredSolution(
+            [course["id"] for course in courses],
+            [course["selected_slot"] for course in courses],
+            lambda position: courses[position],
+        )
+    slots, lines, matrix = _unpack(solver_resualt.snapshot, solver_resualt.assignments)  # type: ignore
+    if not 0 <= index < len(matrix):
+        return None
+    course_index = json.loads(zlib.decompress(solver_resualt.course_index))
+    course_ids = course_index.get("course_ids")
+    if course_ids is None:  # indexed before the course ids were kept
+        course_ids = [json.loads(line)["id"] for line in lines]
+    return _StoredSolution(
+        course_ids,
+        [slots[slot] for slot in matrix[index].tolist()],
+        lambda position: json.loads(lines[position]),
+    )
+
+
+def _slot_key(slot: dict | None) -> tuple | None:
+    if slot is None:
+        return None
+    return (
+        slot["day"],
+        slot["start_time"],
+        slot["end_time"],
+        slot["professor_id"],
+    )
+
+
+def diff_solutions(
+    solver_resualt: SolverResualt,
+    index: int,
+    other_resualt: SolverResualt,
+    other_index: int,
+) -> dict | None:
+    """Courses whose day, time or professor differ between two stored solutions,
+    None if one of them does not exist. Only the changed courses are decoded"""
+    first = _stored_solution(solver_resualt, index)
+    second = _stored_solution(other_resualt, other_index)
+    if first is None or second is None:
+        return None
+    first_positions = {course_id: i for i, course_id in enumerate(first.course_ids)}
+    second_positions = {course_id: i for i, course_id in enumerate(second.course_ids)}
+    courses: list[dict] = []
+    unchanged = 0
+    for course_id in first_positions | second_positions:
+        position = first_positions.get(course_id)
+        other_position = second_positions.get(course_id)
+        before = first.selected[position] if position is not None else None
+        after = second.selected[other_position] if other_position is not None else None
+        if _slot_key(before) == _slot_key(after):
+            unchanged += 1
+            continue
+        course = (
+            first.course(position)
+            if position is not None
+            else second.course(other_position)  # type: ignore
+        )
+        courses.append(
+            {
+                "id": course_id,
+                "title": course["title"],
+                "before": before,
+                "after": after,
+            }
+        )
+    return {"courses": courses, "unchanged": unchanged}
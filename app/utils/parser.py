@@ -1,119 +1,153 @@
 # ruff: noqa: C408
 
-from datetime import datetime, timedelta
+from collections.abc import Iterable
+
+import numpy as np
+from sqlmodel import Session
 
 from app.schemas.course import CourseRead
-from app.schemas.professors import ProfessorRead, TimeSlot, Weekday
+from app.schemas.professors import ProfessorRead
+from app.schemas.solver import Courses as SolverSourses
 from app.schemas.solver import (
-    CourceTimeSlots,
     SolverCourseSelectedDate,
     SolverResualt,
     SolverSolution,
     SolverSolutionCourse,
+    SolverSolutionScore,
 )
-from app.schemas.solver import Courses as SolverSourses
+from app.solver.catalog import slot_catalog
+from app.solver.slots import SlotTable, VariableKey
 
 
-def parse_time_range(time_slot: TimeSlot) -> tuple[Weekday, datetime, datetime]:
-    """Parses a time slot string into day, start time, and end time."""
-    day: int = time_slot.day
-    start_str = time_slot.start_time
-    end_str = time_slot.end_time
-    start_time = datetime.strptime(start_str, "%H:%M")
-    end_time = datetime.strptime(end_str, "%H:%M")
-    return day, start_time, end_time
+def _minutes(value: str) -> int:
+    """hh:mm to minutes since midnight"""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
 
 
-def generate_time_slots(
-    day: Weekday,
-    start_time: datetime,
-    end_time: datetime,
-    duration: timedelta,
-    is_preferred: bool,
-    professor: ProfessorRead,
-) -> list[CourceTimeSlots]:
-    """Generates time slots of given duration within the specified time range."""
-    slots: set[CourceTimeSlots] = set()
-    current_time = start_time
-    while current_time + duration <= end_time:
-        next_time = current_time + duration
-        slot = CourceTimeSlots(
-            day=day.value,
-            start_time=current_time.strftime("%H%M"),
-            end_time=next_time.strftime("%H%M"),
-            original_start=current_time.strftime("%H%M"),
-            prof=professor.id,
-            prefered=is_preferred,
-        )
-        slots.add(slot)
-        current_time = next_time
-    current_time = end_time
-    while current_time - duration >= start_time:
-        next_time = current_time - duration
-        slot = CourceTimeSlots(
-            day=day.value,
-            start_time=next_time.strftime("%H%M"),
-            end_time=current_time.strftime("%H%M"),
-            original_start=next_time.strftime("%H%M"),
-            prof=professor.id,
-            prefered=is_preferred,
-        )
-        slots.add(slot)
-        current_time = next_time
-    time_slots = list(slots)
-    return time_slots
-
-
-def get_professor_slots(prof: ProfessorRead, duration: str) -> list[CourceTimeSlots]:
-    """Returns the sum of all of its ranges in slots of specified duration."""
-    duration_hours, duration_minutes = map(int, duration.split(":"))
-    duration_delta = timedelta(hours=duration_hours, minutes=duration_minutes)
-    all_slots = set()
-
-    for time_slot in prof.time_slots:
-        day, start_time, end_time = parse_time_range(time_slot)
-        is_preferred = day in prof.preferred_days
-        slots = generate_time_slots(
-            day, start_time, end_time, duration_delta, is_preferred, professor=prof
-        )
-        all_slots.update(slots)
-
-    return list(all_slots)
-
-
-def parse_solver_output(
-    sols: list[list[tuple[int, CourceTimeSlots, int]]],
-    input_courses: list[SolverSourses],
-    professors: dict[int, ProfessorRead],
-) -> list[SolverSolution]:
-    solver_resualt = []
-    for sol in sols:
-        solver_solution: SolverSolution = SolverSolution(courses=list())
-        for course_id, timeslot, score in sol:
-            course: SolverSourses = next(
-                (x for x in input_courses if x.id == course_id)
+def professor_windows(prof: ProfessorRead) -> np.ndarray:
+    """Availability windows of the professor as rows of day, start, end (minutes), prefered"""
+    preferred_days = set(prof.preferred_days)
+    return np.array(
+        [
+            (
+                time_slot.day.value,
+                _minutes(time_slot.start_time),
+                _minutes(time_slot.end_time),
+                time_slot.day in preferred_days,
             )
-            solver_sol_course = SolverSolutionCourse(
-                **course.model_dump(exclude={"time_slots"}),
-                selected_slot=SolverCourseSelectedDate(
-                    day=timeslot.day,
-                    start_time=timeslot.start_time,
-                    end_time=timeslot.end_time,
-                    professor_id=timeslot.prof,
-                    professor_name=professors[timeslot.prof].full_name,
-                    prefered=timeslot.prefered,
-                ),
+            for time_slot in prof.time_slots
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+
+
+def generate_time_slots(
+    start: np.ndarray, end: np.ndarray, duration: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Generates the time slots of given duration (minutes) within all the windows at once,
+    walking forward from the start and backward from the end of each window.
+    Returns the window index and the start of every slot, with duplicates"""
+    if duration <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    count = np.maximum((end - start) // duration, 0)
+    window = np.repeat(np.arange(len(start)), count)
+    # position of every slot inside its window
+    step = np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+    forward = start[window] + step * duration
+    backward = end[window] - (step + 1) * duration
+    return np.concatenate([window, window]), np.concatenate([forward, backward])
+
+
+def get_professor_slots(prof: ProfessorRead, duration: str) -> np.ndarray:
+    """Returns the sum of all of its ranges in slots of specified duration,
+    as unique rows of day, start, end (minutes), professor id, prefered"""
+    windows = professor_windows(prof)
+    minutes = _minutes(duration)
+    window, start = generate_time_slots(windows[:, 1], windows[:, 2], minutes)
+    # the duration and professor are fixed, a slot is identified by its start in the week
+    _, unique = np.unique(windows[window, 0] * 1440 + start, return_index=True)
+    window, start = window[unique], start[unique]
+    return np.column_stack(
+        [
+            windows[window, 0],
+            start,
+            start + minutes,
+            np.full(len(start), prof.id, dtype=np.int64),
+            windows[window, 3],
+        ]
+    )
+
+
+class SolverOutputBuilder:
+    """Builds the solver output from (course id, selected slot) pairs, the course payload is
+    dumped once and shared by every solution and equal selected slots share one object"""
+
+    def __init__(
+        self, input_courses: list[SolverSourses], professors: dict[int, ProfessorRead]
+    ) -> None:
+        self.courses: dict[int, dict] = {
+            course.id: course.model_dump(exclude={"time_slots"})
+            for course in input_courses
+        }
+        self.professors = professors
+        # day, start time, end time, professor id, prefered -> selected slot
+        self._selected_slots: dict[tuple, SolverCourseSelectedDate] = {}
+
+    def selected_slot(
+        self, day: int, start_time: str, end_time: str, prof: int, prefered: bool
+    ) -> SolverCourseSelectedDate:
+        key = (day, start_time, end_time, prof, prefered)
+        selected_slot = self._selected_slots.get(key)
+        if selected_slot is None:
+            selected_slot = SolverCourseSelectedDate(
+                day=day,
+                start_time=start_time,
+                end_time=end_time,
+                professor_id=prof,
+                professor_name=self.professors[prof].full_name,
+                prefered=prefered,
             )
-            solver_solution.courses.append(solver_sol_course)
-        solver_resualt.append(solver_solution)
-    return solver_resualt
+            self._selected_slots[key] = selected_slot
+        return selected_slot
+
+    def solution(
+        self,
+        selected: Iterable[VariableKey],
+        score: SolverSolutionScore | None = None,
+    ) -> SolverSolution:
+        # the course payload and the selected slots are already validated
+        return SolverSolution.model_construct(
+            score=score,
+            courses=[
+                SolverSolutionCourse.model_construct(
+                    **self.courses[course_id],
+                    selected_slot=self.selected_slot(*slot),
+                )
+                for course_id, *slot in selected
+            ],
+        )
 
 
 def convert_course_read_list_to_solver_course_list(
     input_courses: list[CourseRead],
-) -> list[SolverSourses]:
-    """converts CoursesRead list to SolverCourses list"""
+    session: Session | None = None,
+) -> tuple[list[SolverSourses], SlotTable]:
+    """converts CoursesRead list to SolverCourses list, the time slots of the courses
+    are returned in a SlotTable (course i of the table is solver course i).
+    The professor slots come from the slot catalog, session is used by its db table"""
     solver_courses: list[SolverSourses] = []
+    # the slots of a professor only depend on the course duration
+    requests: dict[tuple[int, str], tuple[ProfessorRead, str]] = {
+        (professor.id, course.duration): (professor, course.duration)
+        for course in input_courses
+        for professor in course.professors
+    }
+    professor_slots = slot_catalog.get_many(
+        list(requests.values()), get_professor_slots, session
+    )
+    slots: list[np.ndarray] = []
+    slot_counts: list[int] = []
     for course in input_courses:
         solver_course = SolverSourses(
             id=course.id,
@@ -130,9 +164,16 @@ def convert_course_read_list_to_solver_course_list(
             classroom_name=course.classroom.name,  # type: ignore
             major_name=course.major.name,  # type: ignore
         )
-        for professor in course.professors:
-            solver_course.time_slots.extend(
-                get_professor_slots(professor, course.duration)
-            )
+        count = 0
+        # sorted by id so the same input always gives the same table (and model)
+        for professor in sorted(course.professors, key=lambda x: x.id):
+            professor_course_slots = professor_slots[(professor.id, course.duration)]
+            slots.append(professor_course_slots)
+            count += len(professor_course_slots)
+        slot_counts.append(count)
         solver_courses.append(solver_course)
-    return solver_courses
+    rows = np.concatenate(slots) if slots else np.empty((0, 5), dtype=np.int64)
+    course = np.repeat(np.arange(len(solver_courses)), slot_counts)
+    return solver_courses, SlotTable.from_rows(
+        solver_courses, np.column_stack([course, rows])
+    )